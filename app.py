@@ -1,20 +1,23 @@
 import streamlit as st
-from huggingface_hub import InferenceClient
 import os
 from dotenv import load_dotenv
 from datetime import datetime
-from io import BytesIO
-import random
 
-# Load environment variables
+# Load environment variables (before the helper modules below read their settings)
 load_dotenv()
 
+from backends import get_backend
+from generation import find_similar_image, generate_image_bytes
+from metrics import get_metrics, show_metrics_panel
+from models import FALLBACK_MODELS, IMAGE_MODEL
+from prefetch import get_combination_sampler, get_prefetch_pool
+from rate_limit import describe_wait
+
 # Configuration
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
-MODEL_NAME = "black-forest-labs/FLUX.1-schnell"
 
-# Initialize HuggingFace client
-client = InferenceClient(token=HUGGINGFACE_TOKEN)
+# Shared inference backend: the pooled HuggingFace client, or the offline fake (INFERENCE_BACKEND=fake)
+client = get_backend(HUGGINGFACE_TOKEN)
 
 # Random prompt generator components (mix and match for infinite prompts)
 SUBJECTS = [
@@ -63,12 +66,9 @@ DETAILS = [
 
 def generate_random_prompt():
     """Generate a random prompt by combining different elements"""
-    subject = random.choice(SUBJECTS)
-    action = random.choice(ACTIONS)
-    location = random.choice(LOCATIONS)
-    style = random.choice(STYLES)
-    lighting = random.choice(LIGHTING)
-    detail = random.choice(DETAILS)
+    # Process-wide sampler, so no combination is handed out twice
+    sampler = get_combination_sampler("generator", SUBJECTS, ACTIONS, LOCATIONS, STYLES, LIGHTING, DETAILS)
+    subject, action, location, style, lighting, detail = sampler.sample()
 
     prompt = f"{subject} {action} {location}, {lighting}, {style}, {detail}"
     return prompt
@@ -76,20 +76,31 @@ def generate_random_prompt():
 def generate_image(prompt):
     """Generate image from text prompt using InferenceClient"""
     try:
-        # Generate image using text_to_image
-        image = client.text_to_image(prompt, model=MODEL_NAME)
+        # Random prompts from the prefetch pool, like any repeat prompt, come from the disk cache
+        image = generate_image_bytes(client, prompt, IMAGE_MODEL, fallbacks=FALLBACK_MODELS)
         return image
     except Exception as e:
         st.error(f"Error: {str(e)}")
         return None
 
+def prefetch_image(prompt):
+    """Render a random prompt ahead of time (runs on the prefetch thread)"""
+    generate_image_bytes(client, prompt, IMAGE_MODEL, fallbacks=FALLBACK_MODELS)
+
+# Random prompts rendered while the image quota is idle, so Random then Generate is instant
+random_pool = get_prefetch_pool("generator", generate_random_prompt, prefetch_image)
+
+def request_new_image(prompt):
+    """Button callback: generate prompt afresh on the next run instead of reusing a similar image"""
+    st.session_state.force_new_prompt = prompt
+
 # Streamlit UI
 st.title("🎨 AI Image Generator")
 st.write("Create amazing images from text descriptions!")
 
 # Handle random prompt button first (before text area is created)
 if st.session_state.get("random_clicked", False):
-    st.session_state.prompt_value = generate_random_prompt()
+    st.session_state.prompt_value = random_pool.take() or generate_random_prompt()
     st.session_state.random_clicked = False
 
 # Initialize session state for prompt if not exists
@@ -117,17 +128,34 @@ with col2:
         st.session_state.random_clicked = True
         st.rerun()
 
+# "Generate a new one instead" under a reused image regenerates the same prompt on the next run
+force_new = bool(prompt) and st.session_state.pop("force_new_prompt", None) == prompt
+
 # Generate button
-if generate_button:
+if generate_button or force_new:
     if prompt:
-        with st.spinner("Generating your image... ⏳"):
-            image = generate_image(prompt)
+        # A near-identical earlier prompt is served from the cache before any upstream call
+        # (the exact same prompt is already a plain cache hit inside generate_image)
+        similar = None if force_new else find_similar_image(prompt)
+        if similar and similar[1]["prompt"] != prompt:
+            image, match = similar
+            # Earlier images may come from a fallback model, so say which one made it
+            st.info(f"♻️ A similar image already exists ({match['similarity']:.0%} match, made with "
+                    f"{match['model']}): {match['prompt']}")
+            st.button("✨ Generate a new one instead", on_click=request_new_image, args=(prompt,))
+            with get_metrics().timer("render", app="generator"):
+                st.image(image, use_container_width=True)
+            st.session_state.generated_image = image
+        else:
+            with st.spinner(describe_wait("image") or "Generating your image... ⏳"):
+                image = generate_image(prompt)
 
             if image:
                 st.success("Image generated successfully! ✨")
-                st.image(image, use_container_width=True)
+                with get_metrics().timer("render", app="generator"):
+                    st.image(image, use_container_width=True)
 
-                # Store image in session state for download
+                # Store the PNG bytes in session state for download
                 st.session_state.generated_image = image
             else:
                 st.error("Failed to generate image. Please try again.")
@@ -136,18 +164,15 @@ if generate_button:
 
 # Download button (only shows if image exists)
 if "generated_image" in st.session_state and st.session_state.generated_image:
-    # Convert PIL image to bytes
-    img_byte_arr = BytesIO()
-    st.session_state.generated_image.save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
-
     # Generate filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"ai_generated_{timestamp}.png"
 
     st.download_button(
         label="📥 Download Image",
-        data=img_byte_arr,
+        data=st.session_state.generated_image,  # Already PNG bytes, no re-encode per rerun
         file_name=filename,
         mime="image/png"
     )
+
+show_metrics_panel()
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+from inference_client import get_inference_client
+
+# Configuration
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "huggingface")  # "huggingface" or "fake"
+
+# Fake backend behaviour (latencies are medians in seconds; jitter is the spread of a log-normal tail)
+FAKE_IMAGE_LATENCY = float(os.getenv("FAKE_IMAGE_LATENCY", "2.0"))
+FAKE_CHAT_LATENCY = float(os.getenv("FAKE_CHAT_LATENCY", "0.5"))
+FAKE_TOKEN_LATENCY = float(os.getenv("FAKE_TOKEN_LATENCY", "0.02"))
+FAKE_JITTER = float(os.getenv("FAKE_JITTER", "0.3"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))  # Share of calls failing with a 503
+FAKE_QUOTA_RATE = float(os.getenv("FAKE_QUOTA_RATE", "0"))  # Share of calls failing with a 402
+FAKE_IMAGE_SIZE = int(os.getenv("FAKE_IMAGE_SIZE", "512"))
+FAKE_SEED = os.getenv("FAKE_SEED")
+
+CANNED_REPLIES = [
+    "That's a great question! Here's how I'd think about it: start with the basics, then build up step by step.",
+    "Sure! In short: it depends on what you're aiming for, but the simplest option is usually the best place to start.",
+    "Happy to help. The key idea is to break the problem into smaller pieces and tackle them one at a time.",
+    "Good thinking! A few things to keep in mind: be specific, stay consistent, and iterate on what works.",
+]
+
+
+class FakeHTTPError(Exception):
+    """Mimics huggingface_hub's HTTP errors closely enough for the router and limiter"""
+
+    def __init__(self, status, reason):
+        super().__init__(f"{status} Client Error: {reason}" if status < 500 else f"{status} Server Error: {reason}")
+        self.response = SimpleNamespace(status_code=status)
+
+
+def _digest(*parts):
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).digest()
+
+
+class FakeInferenceBackend:
+    """Offline stand-in for InferenceClient with deterministic output and configurable latency and errors"""
+
+    def __init__(self, image_latency=FAKE_IMAGE_LATENCY, chat_latency=FAKE_CHAT_LATENCY,
+                 token_latency=FAKE_TOKEN_LATENCY, jitter=FAKE_JITTER, error_rate=FAKE_ERROR_RATE,
+                 quota_rate=FAKE_QUOTA_RATE, image_size=FAKE_IMAGE_SIZE, seed=FAKE_SEED):
+        self.image_latency = image_latency
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.image_size = image_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self, median):
+        """Sleep for a long-tailed latency, then maybe fail like the real service would"""
+        with self._lock:
+            delay = median * self._random.lognormvariate(0, self.jitter) if median > 0 else 0
+            roll = self._random.random()
+        time.sleep(delay)
+        if roll < self.quota_rate:
+            raise FakeHTTPError(402, "Payment Required")
+        if roll < self.quota_rate + self.error_rate:
+            raise FakeHTTPError(503, "Service Unavailable")
+
+    def text_to_image(self, prompt, *, model=None, width=None, height=None, **params):
+        """Draw a deterministic abstract picture from the prompt hash"""
+        self._simulate(self.image_latency)
+        digest = _digest(model or "", prompt)
+        size = (width or self.image_size, height or self.image_size)
+
+        image = Image.new("RGB", size, tuple(digest[0:3]))
+        draw = ImageDraw.Draw(image)
+        for i in range(6):
+            b = digest[3 + i * 4: 7 + i * 4]
+            x, y = b[0] * size[0] // 255, b[1] * size[1] // 255
+            r = 20 + b[2] * min(size) // 640
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=(b[3], b[0], b[2]))
+        return image
+
+    def _reply(self, messages, max_tokens):
+        prompt = messages[-1]["content"]
+        pages = re.search(r"Split this story into (\d+) scenes", prompt)
+        story = re.search(r"Story: (.*?)\n\n", prompt, re.S)
+
+        if pages and story:
+            sentences = [s.strip() for s in re.split(r"[.!?]+", story.group(1)) if len(s.strip()) > 5] or ["playing outside"]
+            reply = "\n".join(
+                f"Page {i + 1}: {sentences[i % len(sentences)].lower()}" for i in range(int(pages.group(1)))
+            )
+        elif story and "characters" in prompt.lower():
+            # "named Benny" / "Daisy the dinosaur" style mentions
+            matches = re.findall(r"(?:named|called) ([A-Z][a-z]+)|\b([A-Z][a-z]+) the [a-z]+", story.group(1))
+            names = list(dict.fromkeys(a or b for a, b in matches))
+            reply = "\n".join(f"{name} the friendly cartoon animal with bright eyes" for name in names[:4]) \
+                or "Sam the friendly cartoon bunny with long ears"
+        else:
+            reply = CANNED_REPLIES[_digest(prompt)[0] % len(CANNED_REPLIES)]
+
+        # Roughly respect max_tokens (about 4 characters per token)
+        return reply[:max_tokens * 4] if max_tokens else reply
+
+    def chat_completion(self, messages, *, model=None, max_tokens=None, stream=False, **params):
+        """Return a canned reply (story-split prompts get well-formed scene lists) shaped like the real response"""
+        self._simulate(self.chat_latency)
+        reply = self._reply(messages, max_tokens)
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=reply))])
+        return self._stream(reply)
+
+    def _stream(self, reply):
+        for word in re.findall(r"\S+\s*", reply):
+            time.sleep(self.token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))])
+
+
+def get_backend(token):
+    """Return the inference backend chosen by INFERENCE_BACKEND"""
+    if INFERENCE_BACKEND == "fake":
+        return _get_fake_backend()
+    return get_inference_client(token)
+
+
+_fake = None
+_fake_lock = threading.Lock()
+
+
+def _get_fake_backend():
+    global _fake
+    with _fake_lock:
+        if _fake is None:
+            _fake = FakeInferenceBackend()
+        return _fake
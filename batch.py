@@ -0,0 +1,222 @@
+"""Generate images headlessly from a JSONL file of prompts and stories.
+
+Each line is one entry:
+    {"id": "fox", "prompt": "a red fox in the snow"}
+    {"id": "fox-hq", "prompt": "a red fox in the snow", "enhance": true, "model": "black-forest-labs/FLUX.1-schnell"}
+    {"id": "benny", "story": "Once upon a time...", "pages": 5}
+    {"id": "trip", "scenes": ["a bunny packing a bag", "a bunny on a train"]}
+
+Images go to <out>/<id>.png (or <out>/<id>/page_NN.png for stories) and every finished
+entry is appended to <out>/manifest.jsonl. Re-running skips entries already marked done.
+
+Example:
+    python batch.py nightly.jsonl --out batch_output --concurrency 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# Load environment variables (before the helper modules below read their settings)
+load_dotenv()
+
+from backends import get_backend
+from generation import generate_image_bytes, generate_images_as_prompts_arrive, generate_images_concurrently
+from models import CHAT_FALLBACK_MODELS, CHAT_MODEL, FALLBACK_MODELS, IMAGE_MODEL
+from prompts import enhance_image_prompt
+from story import get_story_planner
+
+# Configuration
+HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN", "").strip().strip('"')
+STORY_MAX_WORKERS = int(os.getenv("STORY_MAX_WORKERS", "4"))
+
+_SAFE_ID = re.compile(r"[\w.-]+")
+
+
+def entry_id(entry):
+    """The entry's own id, or a stable hash of its content so resuming works without ids"""
+    if entry.get("id"):
+        return str(entry["id"])
+    return hashlib.sha256(json.dumps(entry, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_entries(path):
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not any(k in entry for k in ("prompt", "story", "scenes")):
+                raise ValueError(f"{path}:{line_number}: needs a prompt, story or scenes")
+            if entry.get("id") and (not _SAFE_ID.fullmatch(str(entry["id"])) or ".." in str(entry["id"])):
+                # Ids become file names under --out, so they must not reach outside it
+                raise ValueError(f"{path}:{line_number}: id may only use letters, digits, '.', '_' and '-' (no '..')")
+            entries.append(entry)
+    return entries
+
+
+def load_done(manifest_path):
+    """IDs the manifest already records as done"""
+    done = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+                if record.get("status") == "done":
+                    done.add(record["id"])
+    return done
+
+
+def write_file(path, data):
+    """Write atomically so a crash never leaves a truncated image behind"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class BatchRunner:
+    """Runs entries with bounded concurrency through the shared generation core"""
+    # Upstream calls go through the same cache, single-flight, rate limiter and
+    # model router as the apps, so a batch never outruns the provider's quota
+
+    def __init__(self, client, out_dir, model=IMAGE_MODEL, chat_model=CHAT_MODEL):
+        self.client = client
+        self.out_dir = out_dir
+        self.model = model
+        self.chat_model = chat_model
+        self.manifest_path = os.path.join(out_dir, "manifest.jsonl")
+        self._manifest_lock = threading.Lock()
+
+    def record(self, record):
+        with self._manifest_lock:
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run_prompt(self, entry_key, entry):
+        model = entry.get("model", self.model)
+        prompt = enhance_image_prompt(entry["prompt"]) if entry.get("enhance") else entry["prompt"]
+        fallbacks = [m for m in FALLBACK_MODELS if m != model]
+        params = {k: entry[k] for k in ("width", "height") if k in entry}
+        data = generate_image_bytes(self.client, prompt, model, fallbacks=fallbacks, **params)
+        path = os.path.join(self.out_dir, f"{entry_key}.png")
+        write_file(path, data)
+        return {"files": [os.path.relpath(path, self.out_dir)], "prompt": prompt, "model": model}
+
+    def run_story(self, entry_key, entry):
+        model = entry.get("model", self.model)
+        fallbacks = [m for m in FALLBACK_MODELS if m != model]
+        started = time.perf_counter()
+        if "scenes" in entry:
+            scenes = list(entry["scenes"])
+            results = generate_images_concurrently(
+                self.client, scenes, model, max_workers=STORY_MAX_WORKERS, fallbacks=fallbacks
+            )
+        else:
+            # Pages start generating while the plan is still streaming, as in the story app
+            scenes = get_story_planner().stream(
+                self.client, entry["story"], int(entry.get("pages", 5)), self.chat_model, fallbacks=CHAT_FALLBACK_MODELS
+            )
+            results = generate_images_as_prompts_arrive(
+                self.client, scenes, model, max_workers=STORY_MAX_WORKERS, fallbacks=fallbacks
+            )
+
+        files, errors, first_page = {}, {}, None
+        for i, data, error in results:
+            if error is not None:
+                errors[i + 1] = str(error)
+                continue
+            if first_page is None:
+                first_page = time.perf_counter() - started
+            path = os.path.join(self.out_dir, entry_key, f"page_{i + 1:02d}.png")
+            write_file(path, data)
+            files[i] = os.path.relpath(path, self.out_dir)
+
+        if errors:
+            raise RuntimeError(f"pages failed: {errors}")
+        prompts = scenes if isinstance(scenes, list) else scenes.plan.scenes()
+        return {
+            "files": [files[i] for i in sorted(files)],
+            "prompts": prompts,
+            "model": model,
+            "first_page_seconds": round(first_page or 0.0, 3),
+        }
+
+    def run_entry(self, entry, retries):
+        entry_key = entry_id(entry)
+        run = self.run_story if "story" in entry or "scenes" in entry else self.run_prompt
+        started = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                result = run(entry_key, entry)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempt < retries:
+                    time.sleep(2 ** attempt)
+                    continue
+                record = {"id": entry_key, "status": "failed", "error": error, "attempts": attempt + 1}
+            else:
+                record = {"id": entry_key, "status": "done", **result, "attempts": attempt + 1}
+            break
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        record["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        self.record(record)
+        return record
+
+    def run(self, entries, concurrency=4, retries=1):
+        """Run every entry not yet done; returns (done, failed, skipped) counts"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        done_ids = load_done(self.manifest_path)
+        pending = [e for e in entries if entry_id(e) not in done_ids]
+        skipped = len(entries) - len(pending)
+        if skipped:
+            print(f"Skipping {skipped} entries already done")
+
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.run_entry, entry, retries) for entry in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                if record["status"] == "done":
+                    done += 1
+                    print(f"[{done + failed}/{len(pending)}] {record['id']} done in {record['seconds']:.1f}s")
+                else:
+                    failed += 1
+                    print(f"[{done + failed}/{len(pending)}] {record['id']} FAILED: {record['error']}")
+        return done, failed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate images from a JSONL file of prompts and stories")
+    parser.add_argument("input", help="JSONL file with one prompt or story per line")
+    parser.add_argument("--out", default="batch_output", help="directory for images and manifest.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4, help="entries generated at the same time")
+    parser.add_argument("--retries", type=int, default=1, help="extra attempts for a failing entry")
+    parser.add_argument("--model", default=IMAGE_MODEL, help="default image model")
+    args = parser.parse_args()
+
+    runner = BatchRunner(get_backend(HUGGINGFACE_TOKEN), args.out, model=args.model)
+    started = time.perf_counter()
+    done, failed, skipped = runner.run(load_entries(args.input), args.concurrency, args.retries)
+    print(f"{done} done, {failed} failed, {skipped} skipped in {time.perf_counter() - started:.1f}s "
+          f"(manifest: {runner.manifest_path})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
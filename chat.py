@@ -0,0 +1,165 @@
+import itertools
+import os
+
+from model_router import get_model_router, is_quota_error
+from rate_limit import get_rate_limiter
+from single_flight import flight_key, get_single_flight
+
+# Configuration
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1500"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+
+
+def _probe_chat(client):
+    """Cheapest possible request to check whether a tripped chat model has recovered"""
+    def probe(model):
+        client.chat_completion(messages=[{"role": "user", "content": "hi"}], model=model, max_tokens=1)
+    return probe
+
+
+def _limited(limiter, fn):
+    """Wrap an upstream call so quota responses slow the limiter down"""
+    def call(routed_model):
+        try:
+            return fn(routed_model)
+        except Exception as e:
+            if is_quota_error(e):
+                limiter.penalize()
+            raise
+    return call
+
+
+def complete_chat(client, messages, model, max_tokens=500, fallbacks=()):
+    """Return the full chat response text, failing over to fallback models"""
+    def complete(routed_model):
+        response = client.chat_completion(
+            messages=messages,
+            model=routed_model,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    def upstream():
+        limiter = get_rate_limiter("chat")
+        limiter.acquire()
+        text = get_model_router().call([model, *fallbacks], _limited(limiter, complete), probe=_probe_chat(client))
+        limiter.reward()
+        return text
+
+    # Identical requests in flight from other sessions share one completion
+    key = flight_key("chat", model, messages, max_tokens)
+    return get_single_flight().do(key, upstream)
+
+
+def stream_chat(client, messages, model, max_tokens=500, fallbacks=()):
+    """Yield chunks of the chat response text as the model produces them"""
+    # Identical requests in flight from other sessions attach to the same stream
+    key = flight_key("chat-stream", model, messages, max_tokens)
+    yield from get_single_flight().stream(key, lambda: _stream_upstream(client, messages, model, max_tokens, fallbacks))
+
+
+def _stream_upstream(client, messages, model, max_tokens, fallbacks):
+    """Open a routed, rate-limited chat stream and yield its text chunks"""
+    def open_stream(routed_model):
+        stream = iter(client.chat_completion(
+            messages=messages,
+            model=routed_model,
+            max_tokens=max_tokens,
+            stream=True
+        ))
+        # Pull the first chunk here so connection and quota errors can still fail over
+        return next(stream, None), stream
+
+    limiter = get_rate_limiter("chat")
+    limiter.acquire()
+    first, stream = get_model_router().call([model, *fallbacks], _limited(limiter, open_stream), probe=_probe_chat(client))
+    limiter.reward()
+    try:
+        if first is None:
+            return
+        for chunk in itertools.chain([first], stream):
+            # Role-only and final usage chunks carry no text
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Runs when the reader stops early too, dropping the HTTP response mid-reply
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def _is_pending(msg):
+    """Placeholder for a reply that is still being generated (it has no text yet)"""
+    return msg.get("type") == "pending"
+
+
+def _turn_text(msg):
+    """Text that represents a history message in the prompt; image payloads are dropped"""
+    if msg.get("type") == "image":
+        return "[generated an image]"
+    return msg["content"]
+
+
+def _compact_line(msg, limit=120):
+    """One short line describing a turn for the rolling summary"""
+    speaker = "User" if msg["role"] == "user" else "Assistant"
+    text = " ".join(_turn_text(msg).split())
+    if len(text) > limit:
+        text = text[:limit].rsplit(" ", 1)[0] + "..."
+    return f"{speaker}: {text}"
+
+
+class ConversationContext:
+    """Builds multi-turn chat payloads that stay within a token budget"""
+    # Recent turns are sent verbatim; turns that fall out of the window are
+    # folded once into a rolling summary that is capped at summary_budget tokens
+
+    def __init__(self, token_budget=CHAT_CONTEXT_TOKENS, summary_budget=CHAT_SUMMARY_TOKENS):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summary_lines = []
+        self.folded = 0  # Number of history messages already folded into the summary
+
+    def _fold(self, messages):
+        self.summary_lines.extend(_compact_line(msg) for msg in messages if not _is_pending(msg))
+        # Forget the oldest summary lines once the summary outgrows its budget
+        while len(self.summary_lines) > 1 and estimate_tokens("\n".join(self.summary_lines)) > self.summary_budget:
+            self.summary_lines.pop(0)
+
+    def build(self, history, message):
+        """Return the messages payload for a new user message given the earlier history"""
+        budget = self.token_budget - estimate_tokens(message) - self.summary_budget
+
+        # Walk back from the newest turn until the verbatim window is full
+        start = len(history)
+        used = 0
+        while start > self.folded:
+            # Replies still in progress (the user sent again while one streams) are skipped
+            cost = 0 if _is_pending(history[start - 1]) else estimate_tokens(_turn_text(history[start - 1]))
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+
+        if start > self.folded:
+            self._fold(history[self.folded:start])
+            self.folded = start
+
+        messages = []
+        if self.summary_lines:
+            messages.append({
+                "role": "system",
+                "content": "Summary of the earlier conversation:\n" + "\n".join(self.summary_lines)
+            })
+        for msg in history[start:]:
+            if _is_pending(msg):
+                continue
+            role = "user" if msg["role"] == "user" else "assistant"
+            messages.append({"role": role, "content": _turn_text(msg)})
+        messages.append({"role": "user", "content": message})
+        return messages
@@ -0,0 +1,22 @@
+import functools
+
+
+def bubble_html(role, content):
+    """Build the chat bubble HTML for one message"""
+    avatar_class, avatar_letter = ("user-avatar", "U") if role == "user" else ("ai-avatar", "Z")
+    return f"""
+            <div class="message-container">
+                <div class="avatar {avatar_class}">{avatar_letter}</div>
+                <div class="message-content">{content}</div>
+            </div>
+            """
+
+
+# Lives outside the app script: Streamlit re-executes the script as a fresh module on
+# every rerun, which would start a cache defined there empty each time
+@functools.lru_cache(maxsize=2048)
+def message_html(role, content):
+    """Chat bubble HTML for a finished message (cached, so reruns don't rebuild old turns)"""
+    # Replies still streaming change on every poll, so they use bubble_html() directly
+    # instead of filling the cache with partial text and evicting the real history
+    return bubble_html(role, content)
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from session_images import PREVIEW_FORMAT, make_preview
+
+# Configuration
+GALLERY_DIR = os.getenv("GALLERY_DIR", ".gallery")
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", "10"))  # Images restored per "load earlier" step
+GALLERY_TTL_DAYS = int(os.getenv("GALLERY_TTL_DAYS", "30"))  # Images older than this are deleted (0 keeps them)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    album TEXT,
+    position INTEGER,
+    prompt TEXT NOT NULL,
+    model TEXT,
+    created REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_by_session ON images (session_id, kind, created);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(prompt, content='images', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+    INSERT INTO images_fts (rowid, prompt) VALUES (new.id, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+    INSERT INTO images_fts (images_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+END;
+"""
+
+COLUMNS = "id, session_id, kind, album, position, prompt, model, created, size, sha256"
+
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+_WORD = re.compile(r"\w+")
+
+
+def is_session_id(value):
+    """Session ids come back from the URL, so only accept the uuid hex format we hand out"""
+    return bool(value) and _SESSION_ID.fullmatch(value) is not None
+
+
+class Gallery:
+    """Persistent image gallery: a SQLite index with full-text prompt search, blobs as files"""
+    # Blobs are content-addressed, so the same image saved by several sessions
+    # (or regenerated from the cache) is only stored once
+
+    def __init__(self, gallery_dir=GALLERY_DIR, ttl_days=GALLERY_TTL_DAYS):
+        self.gallery_dir = gallery_dir
+        os.makedirs(os.path.join(gallery_dir, "blobs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(gallery_dir, "index.sqlite3"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")  # Several app processes may share the index
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False  # SQLite built without FTS5: search falls back to LIKE
+        self._db.commit()
+        if ttl_days > 0:
+            self._prune(ttl_days * 86400)
+
+    def _prune(self, max_age):
+        """Delete images older than max_age, then the blobs no image points at any more"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            self._db.execute("DELETE FROM images WHERE created < ?", (cutoff,))
+            self._db.commit()
+            live = {row[0] for row in self._db.execute("SELECT DISTINCT sha256 FROM images")}
+        blobs_dir = os.path.join(self.gallery_dir, "blobs")
+        for prefix in os.listdir(blobs_dir):
+            prefix_dir = os.path.join(blobs_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, name)
+                # Recent blobs may belong to an add() in another process that hasn't inserted its row yet
+                if name.split(".", 1)[0] not in live and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            if not os.listdir(prefix_dir):
+                os.rmdir(prefix_dir)
+
+    def _blob_path(self, sha256, suffix="png"):
+        return os.path.join(self.gallery_dir, "blobs", sha256[:2], f"{sha256}.{suffix}")
+
+    def add(self, session_id, data, prompt, model=None, kind="image", album=None, position=None):
+        """Save PNG bytes with their metadata and return the gallery id"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha256)
+        if os.path.exists(path):
+            os.utime(path)  # Freshly referenced again, so pruning leaves it alone
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO images (session_id, kind, album, position, prompt, model, created, size, sha256) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (session_id, kind, album, position, prompt, model, time.time(), len(data), sha256)
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def _query(self, sql, params):
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def count(self, session_id, kind):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM images WHERE session_id = ? AND kind = ?", (session_id, kind)
+            ).fetchone()[0]
+
+    def page(self, session_id, kind, offset=0, limit=GALLERY_PAGE_SIZE):
+        """One page of a session's images, newest first"""
+        return self._query(
+            f"SELECT {COLUMNS} FROM images WHERE session_id = ? AND kind = ? "
+            "ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+            (session_id, kind, limit, offset)
+        )
+
+    def latest_album(self, session_id, kind):
+        """The newest image for each position of the session's most recent album (e.g. a story)"""
+        return self._query(
+            f"SELECT {COLUMNS} FROM images WHERE id IN ("
+            "  SELECT MAX(id) FROM images WHERE album = ("
+            "    SELECT album FROM images WHERE session_id = ? AND kind = ? AND album IS NOT NULL"
+            "    ORDER BY id DESC LIMIT 1"
+            "  ) GROUP BY position"
+            ") ORDER BY position",
+            (session_id, kind)
+        )
+
+    def search(self, session_id, text, limit=GALLERY_PAGE_SIZE, offset=0):
+        """A session's images whose prompt contains every word of text (the last one as a prefix)"""
+        words = _WORD.findall(text.lower())
+        if not words:
+            return []
+        if self.full_text:
+            match = " ".join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+            return self._query(
+                f"SELECT {', '.join('images.' + c for c in COLUMNS.split(', '))} FROM images_fts "
+                "JOIN images ON images.id = images_fts.rowid "
+                "WHERE images_fts MATCH ? AND images.session_id = ? "
+                "ORDER BY images.created DESC LIMIT ? OFFSET ?",
+                (match.strip(), session_id, limit, offset)
+            )
+        conditions = " AND ".join("prompt LIKE ?" for _ in words)
+        return self._query(
+            f"SELECT {COLUMNS} FROM images WHERE session_id = ? AND {conditions} "
+            "ORDER BY created DESC LIMIT ? OFFSET ?",
+            (session_id, *(f"%{w}%" for w in words), limit, offset)
+        )
+
+    def sha256(self, image_id):
+        """Content hash of a gallery image, or None for an unknown id"""
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM images WHERE id = ?", (image_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, image_id):
+        """Full PNG bytes of a gallery image, read from disk on demand"""
+        sha256 = self.sha256(image_id)
+        try:
+            with open(self._blob_path(sha256), "rb") as f:
+                return f.read()
+        except (TypeError, FileNotFoundError):
+            return None
+
+    def preview(self, image_id):
+        """Small preview of a gallery image, rendered once and kept next to the blob"""
+        sha256 = self.sha256(image_id)
+        if sha256 is None:
+            return None
+        path = self._blob_path(sha256, f"preview.{PREVIEW_FORMAT.lower()}")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        full = self.get(image_id)
+        if full is None:
+            return None
+        data = make_preview(full)
+        with open(path, "wb") as f:
+            f.write(data)
+        return data
+
+
+def show_gallery_search(session_id):
+    """Sidebar search over this session's saved images"""
+    import streamlit as st
+
+    with st.sidebar.expander("🔎 Search your images"):
+        text = st.text_input("Search prompts", key="gallery_search", label_visibility="collapsed",
+                             placeholder="Search your images...")
+        if not text:
+            return
+        results = get_gallery().search(session_id, text, limit=st.session_state.get("gallery_search_limit", 6))
+        if not results:
+            st.caption("No matching images.")
+        for row in results:
+            st.image(get_gallery().preview(row["id"]), caption=row["prompt"][:80])
+        if len(results) == st.session_state.get("gallery_search_limit", 6):
+            if st.button("Show more", key="gallery_search_more"):
+                st.session_state.gallery_search_limit = len(results) + 6
+                st.rerun()
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    """Return the process-wide gallery"""
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = Gallery()
+        return _gallery
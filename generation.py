@@ -0,0 +1,159 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from hedging import HEDGE_TARGET, IMAGE_HEDGING, get_hedger
+from image_cache import get_image_cache, make_cache_key
+from metrics import get_metrics
+from model_router import get_model_router, is_quota_error
+from prompt_index import get_prompt_index
+from rate_limit import get_rate_limiter
+from single_flight import get_single_flight
+
+# Small request used to check whether a tripped image model has recovered
+PROBE_PROMPT = "a red circle on a white background"
+
+
+def encode_png(image):
+    """Encode a PIL image to PNG bytes"""
+    img_byte_arr = BytesIO()
+    image.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
+def generate_image_bytes(client, prompt, model, fallbacks=(), **params):
+    """Generate an image as PNG bytes, serving repeated model/prompt/params combinations from the disk cache"""
+    key = make_cache_key(model, prompt, **params)
+
+    with get_metrics().timer("generate", model=model) as labels:
+        cached = get_image_cache().get(key)
+        if cached is not None:
+            labels["cache"] = "hit"
+            return cached
+
+        # Identical requests already in flight (from any session) share one upstream call
+        led = []
+
+        def generate():
+            led.append(True)
+            return _generate_uncached(client, prompt, model, fallbacks, params)
+
+        try:
+            return get_single_flight().do(key, generate)
+        finally:
+            labels["cache"] = "miss" if led else "shared"
+
+
+def _generate_uncached(client, prompt, model, fallbacks, params):
+    """Call the provider for a cache miss and store the result"""
+    models = [model, *fallbacks]
+    router = get_model_router()
+    limiter = get_rate_limiter("image")
+    metrics = get_metrics()
+
+    def call_model(routed_model):
+        try:
+            with metrics.timer("text_to_image", model=routed_model):
+                return client.text_to_image(prompt, model=routed_model, **params), routed_model
+        except Exception as e:
+            if is_quota_error(e):
+                limiter.penalize()
+            raise
+
+    def text_to_image(routed_model):
+        if not IMAGE_HEDGING:
+            return call_model(routed_model)
+        # Tail-latency hedge: duplicate slow requests to the next healthy model (or the same one)
+        hedge_model = routed_model
+        if HEDGE_TARGET == "alternate":
+            hedge_model = next((m for m in router.candidates(models) if m != routed_model), routed_model)
+        return get_hedger().call(
+            routed_model, lambda: call_model(routed_model),
+            hedge_model, lambda: call_model(hedge_model)
+        )
+
+    def probe(routed_model):
+        client.text_to_image(PROBE_PROMPT, model=routed_model, width=256, height=256)
+
+    # Queue on the process-wide limiter, then let the router skip models that are
+    # failing or over quota and use the fastest healthy fallback
+    limiter.acquire()
+    image, used_model = router.call(models, text_to_image, probe=probe, served_by=lambda result: result[1])
+    limiter.reward()
+
+    # PIL decodes lazily, so force it here to time decoding apart from encoding
+    with metrics.timer("decode", model=used_model):
+        image.load()
+
+    # Encode exactly once; callers display and download these bytes as-is.
+    # Cached under the model that actually produced the image, and under the requested
+    # model too after a failover, so repeat requests hit the cache during an outage
+    with metrics.timer("png_encode", model=used_model):
+        data = encode_png(image)
+    key = make_cache_key(used_model, prompt, **params)
+    get_image_cache().put(key, data)
+    if used_model != model:
+        get_image_cache().put(make_cache_key(model, prompt, **params), data)
+    get_prompt_index().add(prompt, used_model, key, **params)
+    return data
+
+
+def find_similar_image(prompt, threshold=None, **params):
+    """Return (png_bytes, match) for a cached image from a near-duplicate prompt, or None"""
+    # match has the earlier prompt, its model and the similarity; nothing is sent upstream
+    for match in get_prompt_index().find(prompt, threshold, **params):
+        data = get_image_cache().get(match["key"])
+        if data is None:
+            # Evicted from the cache: drop it so the index doesn't keep sending us to it
+            get_prompt_index().forget(match["key"])
+            continue
+        get_metrics().count("similar_image", model=match["model"])
+        return data, match
+    return None
+
+
+def generate_images_concurrently(client, prompts, model, max_workers=4, fallbacks=(), **params):
+    """Generate images in parallel, yielding (index, png_bytes, error) as each one finishes"""
+    yield from generate_images_as_prompts_arrive(
+        client, enumerate(prompts), model, max_workers=max_workers, fallbacks=fallbacks, **params
+    )
+
+
+def generate_images_as_prompts_arrive(client, prompts, model, max_workers=4, fallbacks=(), **params):
+    """Like generate_images_concurrently, for an iterable of (index, prompt) that is still being produced"""
+    # The prompts are read on a feeder thread, so each image starts as soon as its
+    # prompt exists (e.g. while a story plan is still streaming); errors from the
+    # prompt source are re-raised here once the images already started are yielded
+    finished = queue.Queue()
+    feed = {"submitted": 0, "done": False, "error": None}
+
+    def feeder(executor):
+        try:
+            for i, prompt in prompts:
+                future = executor.submit(generate_image_bytes, client, prompt, model, fallbacks, **params)
+                future.add_done_callback(lambda f, i=i: finished.put((i, f)))
+                feed["submitted"] += 1
+        except Exception as e:
+            feed["error"] = e
+        finally:
+            feed["done"] = True
+            finished.put(None)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        threading.Thread(target=feeder, args=(executor,), daemon=True).start()
+        received = 0
+        while not (feed["done"] and received == feed["submitted"]):
+            item = finished.get()
+            if item is None:
+                continue
+            received += 1
+            i, future = item
+            try:
+                yield i, future.result(), None
+            except Exception as e:
+                # Keep going so one failed page doesn't sink the whole story
+                yield i, None, e
+
+    if feed["error"] is not None:
+        raise feed["error"]
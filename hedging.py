@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Configuration
+IMAGE_HEDGING = os.getenv("IMAGE_HEDGING", "0") == "1"  # Opt-in: hedges spend extra quota
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))  # Latency percentile that triggers a hedge
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))  # Samples needed before hedging starts
+HEDGE_TARGET = os.getenv("HEDGE_TARGET", "alternate")  # "alternate" model or the "same" one
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "100"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "16"))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class Hedger:
+    """Sends a duplicate request when the first one is slower than the recent latency percentile"""
+
+    def __init__(self, pct=HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES, window=HEDGE_WINDOW):
+        self.pct = pct
+        self.min_samples = min_samples
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies = {}  # model -> recent successful latencies
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self, model):
+        """Seconds to wait before hedging a call to model, or None while there is too little data"""
+        with self._lock:
+            samples = list(self._latencies.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.pct)
+
+    def _submit(self, model, fn):
+        start = time.monotonic()
+        future = self._executor.submit(fn)
+
+        def record(f):
+            # Every successful attempt feeds the distribution, including hedges and losers
+            if not f.cancelled() and f.exception() is None:
+                with self._lock:
+                    samples = self._latencies.setdefault(model, deque(maxlen=self.window))
+                    samples.append(time.monotonic() - start)
+
+        future.add_done_callback(record)
+        return future
+
+    def call(self, model, fn, hedge_model, hedge_fn):
+        """Run fn(); if it is still running after the hedge delay, race hedge_fn() against it"""
+        with self._lock:
+            self.requests += 1
+        delay = self.hedge_delay(model)
+        primary = self._submit(model, fn)
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self.hedged += 1
+        hedge = self._submit(hedge_model, hedge_fn)
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # A blocking HTTP call can't be aborted once started, so cancel() only
+                # stops a loser that hasn't started yet; otherwise its result is dropped
+                for loser in pending:
+                    loser.cancel()
+                if future is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return future.result()
+        raise error
+
+    def stats(self):
+        """Hedge rate and win rate, for tuning how much quota hedging spends"""
+        with self._lock:
+            delays = {
+                model: percentile(samples, self.pct)
+                for model, samples in self._latencies.items()
+                if len(samples) >= self.min_samples
+            }
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "hedge_win_rate": self.hedge_wins / self.hedged if self.hedged else 0.0,
+                "hedge_delay": delays,
+            }
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger():
+    """Return the process-wide hedger for image generation"""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger()
+        return _hedger
@@ -0,0 +1,82 @@
+import importlib
+import logging
+import os
+import threading
+
+import huggingface_hub
+import streamlit as st
+from huggingface_hub import InferenceClient
+
+# Configuration
+HF_POOL_SIZE = int(os.getenv("HF_POOL_SIZE", "32"))  # Keep-alive connections kept open per host
+HF_TIMEOUT = float(os.getenv("HF_TIMEOUT", "120"))  # Seconds to wait for an inference response
+HF_CONNECT_TIMEOUT = float(os.getenv("HF_CONNECT_TIMEOUT", "10"))
+HF_KEEPALIVE_EXPIRY = float(os.getenv("HF_KEEPALIVE_EXPIRY", "90"))  # Seconds an idle connection stays open
+HF_WARMUP = os.getenv("HF_WARMUP", "1") == "1"
+HF_WARMUP_URL = os.getenv("HF_WARMUP_URL", "https://router.huggingface.co")
+
+logger = logging.getLogger(__name__)
+
+
+def _configure_http_pool():
+    """Make huggingface_hub share a tuned keep-alive connection pool"""
+    if hasattr(huggingface_hub, "configure_http_backend"):
+        # requests-based releases
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        def backend_factory():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HF_POOL_SIZE, pool_maxsize=HF_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            return session
+
+        huggingface_hub.configure_http_backend(backend_factory=backend_factory)
+        return
+
+    # httpx-style releases: build the client with whichever package the library's own
+    # session comes from (httpx, or httpx2 in newer releases)
+    if not hasattr(huggingface_hub, "set_client_factory"):
+        logger.warning("huggingface_hub %s has no client factory hook; HF_POOL_SIZE, HF_KEEPALIVE_EXPIRY "
+                       "and HF_CONNECT_TIMEOUT are not applied", huggingface_hub.__version__)
+        return
+    session = huggingface_hub.get_session()
+    http = importlib.import_module(type(session).__module__.split(".")[0])
+    if not all(hasattr(http, name) for name in ("Client", "Limits", "Timeout")):
+        logger.warning("Unknown HTTP client %s in huggingface_hub; HF_POOL_SIZE, HF_KEEPALIVE_EXPIRY "
+                       "and HF_CONNECT_TIMEOUT are not applied", type(session).__module__)
+        return
+    event_hooks = session.event_hooks  # The library's request hooks (headers, offline mode)
+
+    def client_factory():
+        return http.Client(
+            limits=http.Limits(
+                max_connections=HF_POOL_SIZE,
+                max_keepalive_connections=HF_POOL_SIZE,
+                keepalive_expiry=HF_KEEPALIVE_EXPIRY
+            ),
+            timeout=http.Timeout(HF_TIMEOUT, connect=HF_CONNECT_TIMEOUT),
+            event_hooks=event_hooks,
+            follow_redirects=True
+        )
+
+    huggingface_hub.set_client_factory(client_factory)
+
+
+def _warm_up():
+    """Open a connection to the inference host so the first generation skips DNS and TLS setup"""
+    try:
+        huggingface_hub.get_session().head(HF_WARMUP_URL, timeout=HF_CONNECT_TIMEOUT)
+    except Exception:
+        pass  # Only an optimisation; real calls report their own errors
+
+
+@st.cache_resource(show_spinner=False)
+def get_inference_client(token):
+    """Return the process-wide InferenceClient for a token, shared across sessions and reruns"""
+    _configure_http_pool()
+    client = InferenceClient(token=token, timeout=HF_TIMEOUT)
+    if HF_WARMUP:
+        threading.Thread(target=_warm_up, name="hf-warmup", daemon=True).start()
+    return client
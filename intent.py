@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Configuration
+INTENT_THRESHOLD = float(os.getenv("INTENT_THRESHOLD", "0.5"))  # Image probability needed to start a generation
+INTENT_TRAIN_FILE = os.getenv("INTENT_TRAIN_FILE", os.path.join(DATA_DIR, "intent_train.jsonl"))
+INTENT_EVAL_FILE = os.getenv("INTENT_EVAL_FILE", os.path.join(DATA_DIR, "intent_eval.jsonl"))
+
+FEATURE_BUCKETS = 1 << 18  # Hashed feature space; collisions are rare at this vocabulary size
+
+# Word-level cues; multi-word cues are matched as bigrams
+VERBS = {"generate", "create", "make", "draw", "design", "paint", "sketch", "render", "illustrate", "visualize", "depict"}
+NOUNS = {
+    "image", "images", "picture", "pictures", "pic", "photo", "photos", "photograph", "portrait", "drawing",
+    "painting", "illustration", "sketch", "wallpaper", "logo", "icon", "artwork", "selfie", "poster",
+    "avatar", "watercolor", "cartoon"
+}
+STYLES = {"digital art", "pixel art", "oil painting", "photorealistic", "realistic", "4k", "8k", "anime", "3d"}
+NEGATIONS = {"don't", "dont", "not", "never", "no", "without", "instead"}
+QUESTIONS = {"how", "what", "why", "when", "who", "where", "which", "explain", "tell", "does", "do", "is", "are"}
+DETERMINERS = {"a", "an", "the", "some", "my", "me", "us", "two", "three"}
+
+# Single pass tokenizer: words (keeping apostrophes) and digits, on word boundaries
+_TOKEN = re.compile(r"\b\w+(?:'\w+)?\b")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+def cue_features(tokens):
+    """Rule cues (verb + image noun, style words, negation, how-to questions) as extra model features"""
+    cues = set()
+    if tokens and tokens[0] in QUESTIONS:
+        cues.add("question_start")
+    negated_until = -1
+    verb_at = None
+    for i, token in enumerate(tokens):
+        bigram = f"{token} {tokens[i + 1]}" if i + 1 < len(tokens) else ""
+        if token in NEGATIONS or bigram == "no need":
+            negated_until = i + 4  # Negation scopes over the next few words
+        elif token in VERBS:
+            verb_at = i
+            if i <= negated_until:
+                cues.add("negated_verb")
+            elif i + 1 < len(tokens) and tokens[i + 1] in DETERMINERS:
+                cues.add("verb_object")
+        elif token in NOUNS:
+            if i <= negated_until:
+                cues.add("negated_noun")
+            elif verb_at is not None and i - verb_at <= 6:
+                cues.add("verb_noun")
+            elif i <= 1:
+                cues.add("noun_start")
+            else:
+                cues.add("noun")
+        if bigram == "show me" and i + 2 < len(tokens):
+            cues.add("show_me_" + ("question" if tokens[i + 2] in QUESTIONS | {"the", "steps"} else "object"))
+        if bigram in STYLES or token in STYLES:
+            cues.add("style")
+    return cues
+
+
+def features(text):
+    """Hashed unigram, bigram and cue features of a message"""
+    tokens = tokenize(text)
+    names = ["bias"]
+    names.extend("w:" + t for t in tokens)
+    names.extend(f"b:{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    names.extend("cue:" + c for c in cue_features(tokens))
+    return {zlib.crc32(name.encode("utf-8")) % FEATURE_BUCKETS for name in names}
+
+
+def load_examples(path):
+    """Read a labelled JSONL set of {"text", "intent"} examples"""
+    with open(path, encoding="utf-8") as f:
+        return [(row["text"], row["intent"] == "image") for row in map(json.loads, f) if row]
+
+
+class IntentModel:
+    """Logistic regression over hashed features, trained in-process on the labelled examples"""
+
+    def __init__(self, threshold=INTENT_THRESHOLD):
+        self.threshold = threshold
+        self.weights = {}
+
+    def train(self, examples, epochs=30, learning_rate=0.5, l2=1e-4, seed=0):
+        rng = random.Random(seed)
+        rows = [(features(text), 1.0 if label else 0.0) for text, label in examples]
+        for _ in range(epochs):
+            rng.shuffle(rows)
+            for feats, label in rows:
+                error = label - self._probability(feats)
+                for f in feats:
+                    w = self.weights.get(f, 0.0)
+                    self.weights[f] = w + learning_rate * (error - l2 * w)
+        return self
+
+    def _probability(self, feats):
+        score = sum(self.weights.get(f, 0.0) for f in feats)
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, score))))
+
+    def probability(self, text):
+        """Probability that a message asks for an image"""
+        return self._probability(features(text))
+
+    def is_image_request(self, text):
+        return self.probability(text) >= self.threshold
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_intent_model():
+    """Return the process-wide intent model, training it on first use (a few milliseconds)"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = IntentModel().train(load_examples(INTENT_TRAIN_FILE))
+        return _model
+
+
+def _keyword_baseline(text):
+    """The original substring check, kept for comparison"""
+    keywords = ["generate", "create", "make", "draw", "design", "image", "picture", "photo", "portrait", "art",
+                "show me", "illustrate", "render", "visualize"]
+    return any(k in text.lower() for k in keywords)
+
+
+def evaluate(classify, examples):
+    tp = sum(1 for text, label in examples if label and classify(text))
+    fp = sum(1 for text, label in examples if not label and classify(text))
+    fn = sum(1 for text, label in examples if label and not classify(text))
+    correct = sum(1 for text, label in examples if classify(text) == label)
+    return {
+        "accuracy": correct / len(examples),
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 0.0,
+        "wasted_image_calls": fp,
+        "missed_images": fn,
+    }
+
+
+def main():
+    """Score the model and the old keyword check on the held-out set, then benchmark latency"""
+    started = time.perf_counter()
+    model = get_intent_model()
+    train_ms = (time.perf_counter() - started) * 1000
+    examples = load_examples(INTENT_EVAL_FILE)
+
+    for name, classify in (("keywords", _keyword_baseline), ("model", model.is_image_request)):
+        stats = evaluate(classify, examples)
+        print(f"{name:<9} accuracy {stats['accuracy']:.1%}  precision {stats['precision']:.1%}  "
+              f"recall {stats['recall']:.1%}  wasted image calls {stats['wasted_image_calls']}  "
+              f"missed images {stats['missed_images']}")
+    for text, label in examples:
+        if model.is_image_request(text) != label:
+            print(f"  misclassified ({model.probability(text):.2f}): {text}")
+
+    timings = []
+    for _ in range(200):
+        for text, _ in examples:
+            start = time.perf_counter()
+            model.is_image_request(text)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"training {train_ms:.0f}ms; per message p50 {timings[len(timings) // 2] * 1e6:.0f}us  "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
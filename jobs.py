@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))  # Chat and other quick jobs
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "4"))  # Image and storybook jobs
+JOB_TTL = float(os.getenv("JOB_TTL", "900"))  # Seconds a finished job's result is kept for pickup
+
+
+class Job:
+    """State of one background job"""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "pending"  # pending -> running -> done / failed / cancelled
+        self.result = None
+        self.error = None
+        self.partial = ""  # Text received so far, for streaming jobs
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+        self.waiters = 0  # Sessions attached to the job that haven't released it yet
+
+
+class JobExecutor:
+    """Runs generation work off the Streamlit script thread so it survives reruns"""
+    # Sessions keep only the job ID and poll status(); jobs submitted with the same
+    # key while one is pending, running or done attach to it instead of running twice.
+    # Image jobs can sit in the image rate limiter for a long time, so they run in their
+    # own lane and never hold the workers that chat replies need.
+
+    def __init__(self, max_workers=JOB_WORKERS, image_workers=IMAGE_JOB_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._pools = {
+            "chat": ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-chat"),
+            "image": ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix="job-image"),
+        }
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+
+    def _drop(self, job):
+        del self._jobs[job.id]
+        if job.key is not None and self._by_key.get(job.key) == job.id:
+            del self._by_key[job.key]
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.ttl
+        for job in list(self._jobs.values()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                self._drop(job)
+
+    def submit(self, fn, *args, key=None, stream=False, lane="chat", **kwargs):
+        """Start fn(*args, **kwargs) in the background on lane ("chat" or "image") and return its job ID"""
+        # With stream=True, fn is a generator of text chunks: they are exposed as the job's
+        # partial text while it runs and joined together as the result
+        with self._lock:
+            self._prune()
+            if key is not None and key in self._by_key:
+                existing = self._jobs[self._by_key[key]]
+                if existing.status not in ("failed", "cancelled"):
+                    existing.waiters += 1
+                    return existing.id
+
+            job = Job(key)
+            job.waiters = 1
+            self._jobs[job.id] = job
+            if key is not None:
+                self._by_key[key] = job.id
+            job.future = self._pools[lane].submit(self._run, job, fn, args, kwargs, stream)
+            return job.id
+
+    def _run(self, job, fn, args, kwargs, stream):
+        with self._lock:
+            if job.cancel_requested:
+                # Cancelled after the pool picked it up but before it started
+                job.status = "cancelled"
+                job.finished_at = time.monotonic()
+                return
+            job.status = "running"
+        try:
+            if stream:
+                chunks = fn(*args, **kwargs)
+                try:
+                    for chunk in chunks:
+                        if job.cancel_requested:
+                            break
+                        job.partial += chunk
+                finally:
+                    chunks.close()  # Stops the upstream stream once nobody else is reading it
+                result = job.partial
+            else:
+                result = fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                job.status = "failed"
+                job.error = e
+                job.finished_at = time.monotonic()
+            return
+        with self._lock:
+            # A blocking call can't be interrupted, and other sessions may be attached to it
+            job.status = "cancelled" if stream and job.cancel_requested else "done"
+            job.result = result
+            job.finished_at = time.monotonic()
+
+    def status(self, job_id):
+        """Return "pending", "running", "done", "failed", "cancelled", or None for unknown/expired jobs"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.status if job else None
+
+    def partial(self, job_id):
+        """Text streamed so far by a streaming job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.partial if job else ""
+
+    def result(self, job_id):
+        """Return a finished job's result, re-raising its error if it failed"""
+        with self._lock:
+            job = self._jobs[job_id]
+        if job.status == "failed":
+            raise job.error
+        return job.result
+
+    def release(self, job_id):
+        """Drop a job once every session attached to it has collected its outcome"""
+        # Results such as PNG bytes would otherwise stay in memory until JOB_TTL
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.waiters -= 1
+            if job.waiters <= 0:
+                self._drop(job)
+
+    def cancel(self, job_id):
+        """Stop a job: pending jobs never start, streaming jobs stop at the next chunk, others run to completion"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished_at is not None:
+                return False
+            job.cancel_requested = True
+            if job.future.cancel():
+                job.status = "cancelled"
+                job.finished_at = time.monotonic()
+            return True
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor():
+    """Return the process-wide background job executor"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor()
+        return _executor
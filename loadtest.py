@@ -0,0 +1,243 @@
+"""Load-test the Streamlit apps with simulated sessions against the offline fake backend.
+
+Example:
+    python loadtest.py --sessions 20 --actions 10 --mix chat=5,image=3,story=1,generator=1
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+APPS = {"chat": "portrait_app.py", "image": "portrait_app.py", "story": "portrait_app_backup.py", "generator": "app.py"}
+
+SUBJECTS = ["a red fox", "a lighthouse", "an old robot", "a mountain village", "a sailing ship", "a cat astronaut"]
+PLACES = ["at sunset", "in the rain", "on the moon", "in a neon city", "under the sea", "in a snowy forest"]
+QUESTIONS = ["what is a haiku", "tell me a joke", "how do rainbows form", "give me a pasta recipe", "explain gravity"]
+
+# AppTest shares one global runtime per process, so script runs are serialized.
+# Background work (jobs, story pages, probes) still runs concurrently, as on a real server.
+_script_lock = threading.Lock()
+
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(values):
+    """p50/p95/p99 (nearest rank) of a list of seconds"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "count": 0}
+    ordered = sorted(values)
+
+    def rank(pct):
+        return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "count": len(ordered)}
+
+
+class SimulatedSession:
+    """One browser session clicking through the apps"""
+
+    def __init__(self, index, args, results):
+        self.index = index
+        self.args = args
+        self.results = results
+        self.random = random.Random(args.seed + index)
+        self.apps = {}
+        self.script_times = []
+
+    def _run(self, at):
+        with _script_lock:
+            start = time.perf_counter()
+            at.run()
+            self.script_times.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    def _app(self, name):
+        from streamlit.testing.v1 import AppTest
+        if name not in self.apps:
+            at = AppTest.from_file(os.path.join(APP_DIR, name), default_timeout=self.args.timeout)
+            self._run(at)
+            self.apps[name] = at
+        return self.apps[name]
+
+    def _prompt(self):
+        return f"{self.random.choice(SUBJECTS)} {self.random.choice(PLACES)}, variation {self.random.randrange(self.args.prompt_space)}"
+
+    def _zeno(self, message):
+        at = self._app(APPS["chat"])
+        at.text_input[0].input(message)
+        at.button[-1].click()
+        self._run(at)
+        # Poll like the fragment does until the background job has landed
+        deadline = time.monotonic() + self.args.timeout
+        while any(m.get("type") == "pending" for m in at.session_state.messages):
+            if time.monotonic() > deadline:
+                raise TimeoutError("job did not finish")
+            time.sleep(self.args.poll)
+            self._run(at)
+        return at.session_state.messages[-1].get("type") != "pending"
+
+    def chat(self):
+        return self._zeno(self.random.choice(QUESTIONS))
+
+    def image(self):
+        return self._zeno(f"generate an image of {self._prompt()}")
+
+    def story(self):
+        at = self._app(APPS["story"])
+        if at.radio[0].value != "Multiple Images (Story)":
+            at.radio[0].set_value("Multiple Images (Story)")
+            self._run(at)
+        pages = [self._prompt() for _ in range(self.random.randint(3, 5))]
+        at.text_area[0].input("\n".join(pages))
+        at.main.button[-1].click()
+        self._run(at)
+        return all(at.session_state.generated_images)
+
+    def generator(self):
+        at = self._app(APPS["generator"])
+        at.text_area[0].input(self._prompt())
+        at.button[0].click()
+        self._run(at)
+        return bool(at.session_state.generated_image)
+
+    def run(self):
+        kinds, weights = zip(*self.args.mix.items())
+        for _ in range(self.args.actions):
+            time.sleep(self.random.expovariate(1 / self.args.think) if self.args.think else 0)
+            kind = self.random.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok, error = getattr(self, kind)(), None
+            except Exception as e:
+                ok, error = False, f"{type(e).__name__}: {e}"
+            self.results.append({
+                "session": self.index,
+                "kind": kind,
+                "latency": time.perf_counter() - start,
+                "ok": ok,
+                "error": error,
+            })
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in APPS:
+            raise argparse.ArgumentTypeError(f"unknown action {kind!r}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the Streamlit apps with N simulated sessions")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--actions", type=int, default=5, help="actions per session")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=5,image=3,story=1,generator=1"))
+    parser.add_argument("--think", type=float, default=0.5, help="mean think time between actions (s)")
+    parser.add_argument("--poll", type=float, default=0.2, help="poll interval for background jobs (s)")
+    parser.add_argument("--prompt-space", type=int, default=1000, help="distinct prompt variations (lower = more repeats)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm-cache", action="store_true", help="reuse the configured on-disk caches")
+    parser.add_argument("--output", default="loadtest_results.jsonl", help="JSONL file the run summary is appended to")
+    args = parser.parse_args()
+
+    # Everything must be configured before the apps import the helper modules
+    os.environ.setdefault("INFERENCE_BACKEND", "fake")
+    if not args.warm_cache:
+        scratch = tempfile.mkdtemp(prefix="loadtest-")
+        os.environ["IMAGE_CACHE_DIR"] = os.path.join(scratch, "image_cache")
+        os.environ["SESSION_IMAGE_DIR"] = os.path.join(scratch, "session_images")
+        os.environ["GALLERY_DIR"] = os.path.join(scratch, "gallery")
+    sys.path.insert(0, APP_DIR)
+
+    # Load streamlit and every app once so RSS growth reflects sessions, not imports
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+    warmup = SimulatedSession(-1, args, [])
+    for kind in args.mix:
+        warmup._app(APPS[kind])
+
+    results = []
+    sessions = [SimulatedSession(i, args, results) for i in range(args.sessions)]
+    threads = [threading.Thread(target=s.run, name=f"session-{s.index}") for s in sessions]
+
+    rss_start = rss_bytes()
+    rss_peak = rss_start
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(0.5)
+        rss_peak = max(rss_peak, rss_bytes())
+    wall = time.perf_counter() - started
+    rss_end = rss_bytes()
+
+    summary = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "backend": os.environ["INFERENCE_BACKEND"],
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "wall_seconds": wall,
+        "actions": len(results),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "throughput_per_s": len(results) / wall if wall else 0.0,
+        "latency": {"all": percentiles([r["latency"] for r in results if r["ok"]])},
+        "script_time": percentiles([t for s in sessions for t in s.script_times]),
+        "rss": {
+            "start_mb": rss_start / 2**20,
+            "end_mb": rss_end / 2**20,
+            "peak_mb": rss_peak / 2**20,
+            "growth_per_session_mb": (rss_end - rss_start) / 2**20 / max(1, args.sessions),
+        },
+        "sample_errors": sorted({r["error"] for r in results if r["error"]})[:5],
+    }
+    for kind in args.mix:
+        summary["latency"][kind] = percentiles([r["latency"] for r in results if r["ok"] and r["kind"] == kind])
+
+    with open(args.output, "a") as f:
+        f.write(json.dumps(summary) + "\n")
+
+    print(f"{summary['actions']} actions in {wall:.1f}s ({summary['throughput_per_s']:.2f}/s), {summary['errors']} errors")
+    for name, stats in summary["latency"].items():
+        if stats["count"]:
+            print(f"  {name:<10} p50 {stats['p50']:.2f}s  p95 {stats['p95']:.2f}s  p99 {stats['p99']:.2f}s  (n={stats['count']})")
+    script = summary["script_time"]
+    if script["count"]:
+        print(f"  script run p50 {script['p50'] * 1000:.0f}ms  p95 {script['p95'] * 1000:.0f}ms  p99 {script['p99'] * 1000:.0f}ms")
+    print(f"  RSS {summary['rss']['start_mb']:.0f} -> {summary['rss']['end_mb']:.0f} MB "
+          f"(peak {summary['rss']['peak_mb']:.0f} MB, {summary['rss']['growth_per_session_mb']:.2f} MB/session)")
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hedging import get_hedger, percentile
+
+# Configuration
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Serve OpenMetrics text on this port (0 = off)
+METRICS_TRACE_FILE = os.getenv("METRICS_TRACE_FILE", "")  # Append one JSON line per timed stage (empty = off)
+METRICS_TRACE_MAX_MB = float(os.getenv("METRICS_TRACE_MAX_MB", "50"))  # Roll the trace over to <file>.1 past this size
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "500"))  # Recent samples per series kept for percentiles
+METRICS_PANEL = os.getenv("METRICS_PANEL", "0") == "1"  # Show the debug panel in the app sidebars
+
+# Histogram bucket bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "imagegen"
+
+
+class _Series:
+    """Histogram of one stage + label combination"""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=METRICS_WINDOW)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    """Per-stage timings and counters, exported as OpenMetrics text and an optional JSONL trace"""
+
+    def __init__(self, trace_file=METRICS_TRACE_FILE, trace_max_bytes=METRICS_TRACE_MAX_MB * 1024 * 1024):
+        self.trace_file = trace_file
+        self.trace_max_bytes = trace_max_bytes
+        self._lock = threading.Lock()
+        self._series = {}  # (stage, sorted label items) -> _Series
+        self._counters = {}  # (name, sorted label items) -> int
+        self._trace = None
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Time a block as one sample of a stage; the yielded labels can be filled in by the block"""
+        # Exceptions are recorded under their class name and re-raised
+        start = time.perf_counter()
+        labels.setdefault("error", "")
+        try:
+            yield labels
+        except Exception as e:
+            labels["error"] = type(e).__name__
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, stage, seconds, **labels):
+        """Record one duration for a stage"""
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.count += 1
+            series.sum += seconds
+            series.recent.append(seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series.buckets[i] += 1
+            if self.trace_file:
+                self._write_trace({"ts": time.time(), "stage": stage, "seconds": round(seconds, 6), **labels})
+
+    def count(self, name, **labels):
+        """Increment a counter"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def _write_trace(self, record):
+        try:
+            if self._trace is None:
+                self._trace = open(self.trace_file, "a", encoding="utf-8")
+            self._trace.write(json.dumps(record) + "\n")
+            self._trace.flush()
+            if self._trace.tell() > self.trace_max_bytes:
+                self._trace.close()
+                self._trace = None
+                os.replace(self.trace_file, self.trace_file + ".1")
+        except OSError:
+            pass  # Tracing must never break generation
+
+    def openmetrics(self):
+        """Render everything in the OpenMetrics text format"""
+        with self._lock:
+            series = sorted(self._series.items())
+            counters = dict(self._counters)
+        # Hedging keeps its own tallies; hedge rate = hedges / hedge_requests, win rate = hedge_wins / hedges
+        hedging = get_hedger().stats()
+        for name, stat in (("hedge_requests", "requests"), ("hedges", "hedged"), ("hedge_wins", "hedge_wins")):
+            counters[(name, ())] = hedging[stat]
+        counters = sorted(counters.items())
+
+        lines = [
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+            f"# UNIT {PREFIX}_stage_seconds seconds",
+            f"# HELP {PREFIX}_stage_seconds Time spent in each generation stage.",
+        ]
+        for (stage, items), s in series:
+            labels = {"stage": stage, **dict(items)}
+            for bound, n in zip(BUCKETS, s.buckets):
+                lines.append(f"{PREFIX}_stage_seconds_bucket{_label_text({**labels, 'le': float(bound)})} {n}")
+            lines.append(f"{PREFIX}_stage_seconds_bucket{_label_text({**labels, 'le': '+Inf'})} {s.count}")
+            lines.append(f"{PREFIX}_stage_seconds_count{_label_text(labels)} {s.count}")
+            lines.append(f"{PREFIX}_stage_seconds_sum{_label_text(labels)} {s.sum:.6f}")
+
+        for name in dict.fromkeys(name for (name, _), _ in counters):
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            for (counter, items), n in counters:
+                if counter == name:
+                    lines.append(f"{PREFIX}_{name}_total{_label_text(dict(items))} {n}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Per-series count, error count, mean and recent percentiles, for the debug panel"""
+        with self._lock:
+            rows = []
+            for (stage, items), s in sorted(self._series.items()):
+                recent = list(s.recent)
+                rows.append({
+                    "stage": stage,
+                    **dict(items),
+                    "count": s.count,
+                    "mean_ms": round(s.sum / s.count * 1000, 1),
+                    "p50_ms": round(percentile(recent, 50) * 1000, 1),
+                    "p95_ms": round(percentile(recent, 95) * 1000, 1),
+                })
+            counters = {
+                name + _label_text(dict(items)): n for (name, items), n in sorted(self._counters.items())
+            }
+        return rows, counters
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = get_metrics().openmetrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise flood the Streamlit log
+
+
+def _start_server(port):
+    """Serve /metrics on a side port (Streamlit has no hook for extra routes)"""
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError:
+        return  # Port taken, e.g. by another app process already exporting
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+def show_metrics_panel():
+    """Debug panel in the sidebar with stage timings and the shared components' stats (METRICS_PANEL=1)"""
+    if not METRICS_PANEL:
+        return
+    import streamlit as st
+    from image_cache import get_image_cache
+    from model_router import get_model_router
+    from prefetch import prefetch_stats
+    from prompt_index import get_prompt_index
+    from rate_limit import get_rate_limiter
+    from single_flight import get_single_flight
+
+    rows, counters = get_metrics().summary()
+    with st.sidebar.expander("🛠️ Debug metrics"):
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.caption("No stages timed yet.")
+        st.json({
+            "counters": counters,
+            "image_cache": get_image_cache().stats(),
+            "prompt_index": get_prompt_index().stats(),
+            "single_flight": get_single_flight().stats(),
+            "image_limiter": get_rate_limiter("image").stats(),
+            "router": get_model_router().snapshot(),
+            "hedging": get_hedger().stats(),
+            "prefetch": prefetch_stats(),
+        }, expanded=False)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide metrics registry, starting the export endpoint on first use"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            if METRICS_PORT:
+                _start_server(METRICS_PORT)
+        return _metrics
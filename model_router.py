@@ -0,0 +1,213 @@
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+# Configuration
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "20"))  # Calls remembered per model
+ROUTER_MIN_CALLS = int(os.getenv("ROUTER_MIN_CALLS", "3"))  # Calls needed before the error rate counts
+ROUTER_ERROR_RATE = float(os.getenv("ROUTER_ERROR_RATE", "0.5"))  # Error rate that opens a circuit
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))  # Seconds before a failing model is retried
+ROUTER_QUOTA_COOLDOWN = float(os.getenv("ROUTER_QUOTA_COOLDOWN", "300"))  # Same, for quota errors and gone models
+ROUTER_PROBE_INTERVAL = float(os.getenv("ROUTER_PROBE_INTERVAL", "5"))
+
+
+def status_code(error):
+    """HTTP status code of a failed inference call, if it has one"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_quota_error(error):
+    """Check if an inference error means we are out of quota or being rate limited"""
+    if status_code(error) in (402, 429):
+        return True
+    error_msg = str(error)
+    return any(marker in error_msg for marker in ("402", "Payment Required", "429", "Too Many Requests"))
+
+
+def is_request_error(error):
+    """Check if the provider rejected the request itself (bad input, too large, safety filter)"""
+    # Other 4xx responses are about one model (gated, removed, over quota) and still mean "try elsewhere"
+    return status_code(error) in (400, 413, 422)
+
+
+def is_model_unavailable(error):
+    """Check if the model is gated (403) or no longer served (404/410) rather than briefly failing"""
+    return status_code(error) in (403, 404, 410)
+
+
+class ModelHealth:
+    """Rolling latency/error record and circuit breaker state for one model"""
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.calls = deque(maxlen=window)  # (succeeded, latency in seconds)
+        self.open_until = 0.0  # Circuit is open (model skipped) until this time
+        self.trial_in_flight = False
+        self.last_error = None
+
+    def is_open(self):
+        return self.open_until > 0
+
+    def available(self, now):
+        """Closed circuits take traffic; open ones let a single trial through after the cooldown"""
+        if not self.is_open():
+            return True
+        return now >= self.open_until and not self.trial_in_flight
+
+    def mean_latency(self):
+        latencies = [latency for ok, latency in self.calls if ok]
+        return statistics.fmean(latencies) if latencies else None
+
+    def error_rate(self):
+        if not self.calls:
+            return 0.0
+        return sum(1 for ok, _ in self.calls if not ok) / len(self.calls)
+
+    def record_success(self, latency):
+        self.calls.append((True, latency))
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    def record_failure(self, error, latency, now):
+        self.calls.append((False, latency))
+        self.last_error = error
+        self.trial_in_flight = False
+        if is_quota_error(error) or is_model_unavailable(error):
+            # Retrying soon won't help, so trip the circuit on the first such error
+            self.open_until = now + ROUTER_QUOTA_COOLDOWN
+        elif self.is_open() or (len(self.calls) >= ROUTER_MIN_CALLS and self.error_rate() >= ROUTER_ERROR_RATE):
+            self.open_until = now + ROUTER_COOLDOWN
+
+
+class ModelRouter:
+    """Routes inference calls to the preferred healthy model, failing over to the fastest healthy fallback"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health = {}  # model -> ModelHealth, shared by every session in the process
+        self._probes = {}  # model -> callable used to re-check a tripped model in the background
+        self._prober = None
+
+    def _get_health(self, model):
+        if model not in self._health:
+            self._health[model] = ModelHealth()
+        return self._health[model]
+
+    def candidates(self, models):
+        """Order models for a call: preferred model first if healthy, then fallbacks by latency"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [m for m in models if self._get_health(m).available(now)]
+            if not healthy:
+                return []
+            preferred, fallbacks = (healthy[0], healthy[1:]) if healthy[0] == models[0] else (None, healthy)
+            # Unmeasured fallbacks keep their configured order after the measured ones
+            fallbacks.sort(key=lambda m: (self._health[m].mean_latency() is None,
+                                          self._health[m].mean_latency() or 0.0))
+            return ([preferred] if preferred else []) + fallbacks
+
+    def call(self, models, fn, probe=None, served_by=None):
+        """Run fn(model) on the best available model, failing over on errors"""
+        # served_by(result) names the model that actually answered when fn may hand the
+        # call to another one (a winning hedge), so health is recorded against that model
+        if probe is not None:
+            self._start_prober(models, probe)
+
+        last_error = None
+        for model in self.candidates(models):
+            with self._lock:
+                health = self._get_health(model)
+                if health.is_open():
+                    if not health.available(time.monotonic()):
+                        continue  # Another request grabbed the trial slot
+                    health.trial_in_flight = True
+
+            start = time.monotonic()
+            try:
+                result = fn(model)
+            except Exception as e:
+                if is_request_error(e):
+                    # The same request would be rejected by every model; the model itself is fine
+                    with self._lock:
+                        health.trial_in_flight = False
+                    raise
+                with self._lock:
+                    health.record_failure(e, time.monotonic() - start, time.monotonic())
+                last_error = e
+                continue
+            served = served_by(result) if served_by is not None else model
+            with self._lock:
+                health.trial_in_flight = False
+                self._get_health(served).record_success(time.monotonic() - start)
+            return result
+
+        if last_error is None:
+            # Every circuit is open; surface why the preferred model was tripped
+            with self._lock:
+                last_error = self._get_health(models[0]).last_error
+            if last_error is None:
+                last_error = RuntimeError("All models are temporarily unavailable")
+        raise last_error
+
+    def _start_prober(self, models, probe):
+        with self._lock:
+            for model in models:
+                self._probes.setdefault(model, probe)
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_loop, name="model-router-probe", daemon=True)
+                self._prober.start()
+
+    def _probe_loop(self):
+        """Re-check tripped models in the background so users don't pay for the trial request"""
+        while True:
+            time.sleep(ROUTER_PROBE_INTERVAL)
+            now = time.monotonic()
+            with self._lock:
+                due = []
+                for model, health in self._health.items():
+                    if health.is_open() and health.available(now) and model in self._probes:
+                        health.trial_in_flight = True
+                        due.append((model, health))
+            for model, health in due:
+                start = time.monotonic()
+                try:
+                    self._probes[model](model)
+                except Exception as e:
+                    with self._lock:
+                        if is_request_error(e):
+                            health.trial_in_flight = False  # Model answered; try the probe again later
+                        else:
+                            health.record_failure(e, time.monotonic() - start, time.monotonic())
+                else:
+                    with self._lock:
+                        health.record_success(time.monotonic() - start)
+
+    def snapshot(self):
+        """Per-model health for debugging and metrics"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "circuit": "open" if health.is_open() else "closed",
+                    "retry_in": max(0.0, health.open_until - now) if health.is_open() else 0.0,
+                    "error_rate": health.error_rate(),
+                    "mean_latency": health.mean_latency(),
+                    "calls": len(health.calls),
+                }
+                for model, health in self._health.items()
+            }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """Return the process-wide model router"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
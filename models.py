@@ -0,0 +1,14 @@
+# Models shared by the apps and the batch runner, in failover order
+IMAGE_MODEL = "black-forest-labs/FLUX.1-schnell"  # Fast, working model
+# Fallback models if quota exceeded
+FALLBACK_MODELS = [
+    "stabilityai/stable-diffusion-xl-base-1.0",
+    "runwayml/stable-diffusion-v1-5",
+    "CompVis/stable-diffusion-v1-4"
+]
+CHAT_MODEL = "meta-llama/Llama-3.2-3B-Instruct"  # Working chat model
+# Fallback chat models if the primary one is failing or over quota
+CHAT_FALLBACK_MODELS = [
+    "Qwen/Qwen2.5-7B-Instruct",
+    "mistralai/Mistral-7B-Instruct-v0.3"
+]
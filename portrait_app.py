@@ -1,10 +1,26 @@
 import streamlit as st
-from huggingface_hub import InferenceClient
 import os
 from dotenv import load_dotenv
 from datetime import datetime
-from io import BytesIO
 import random
+import time
+import uuid
+
+# Load environment variables (before the helper modules below read their settings)
+load_dotenv()
+
+from backends import get_backend
+from chat import ConversationContext, stream_chat
+from chat_html import bubble_html, message_html
+from gallery import get_gallery, is_session_id, show_gallery_search
+from generation import find_similar_image, generate_image_bytes
+from intent import get_intent_model
+from jobs import get_job_executor
+from metrics import get_metrics, show_metrics_panel
+from model_router import is_quota_error
+from models import CHAT_FALLBACK_MODELS, CHAT_MODEL, FALLBACK_MODELS, IMAGE_MODEL
+from prompts import enhance_image_prompt
+from rate_limit import RateLimitExceeded, describe_wait
 
 # Page configuration
 st.set_page_config(
@@ -17,16 +33,22 @@ st.set_page_config(
     }
 )
 
-# Load environment variables
-load_dotenv()
-
 # Configuration
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN", "").strip().strip('"')
-IMAGE_MODEL = "black-forest-labs/FLUX.1-schnell"  # Fast, working model
-CHAT_MODEL = "meta-llama/Llama-3.2-3B-Instruct"  # Working chat model
+# Messages drawn on each rerun; older ones wait behind "Load earlier messages"
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "40"))
+
+# Shared inference backend: the pooled HuggingFace client, or the offline fake (INFERENCE_BACKEND=fake)
+client = get_backend(HUGGINGFACE_TOKEN)
 
-# Initialize HuggingFace client
-client = InferenceClient(token=HUGGINGFACE_TOKEN)
+# Persistent gallery: every generated image is saved there once, and messages only keep its id
+gallery = get_gallery()
+
+# Process-wide intent classifier, trained once from intent_train.jsonl
+intent_model = get_intent_model()
+
+# Generation runs as background jobs so it survives reruns; messages keep the job ID
+jobs = get_job_executor()
 
 # Professional CSS styling - ChatGPT style
 st.markdown("""
@@ -222,72 +244,253 @@ st.markdown("""
 </script>
 """, unsafe_allow_html=True)
 
-def enhance_image_prompt(user_prompt):
-    """Enhance user prompt for better image generation"""
-    # Add professional photography terms for realistic results
-    enhancements = [
-        "ultra realistic",
-        "8k uhd",
-        "high quality",
-        "professional photography",
-        "detailed",
-        "sharp focus",
-        "natural lighting",
-        "depth of field"
-    ]
-
-    # Check if prompt already has quality terms
-    if not any(term in user_prompt.lower() for term in ["realistic", "quality", "4k", "8k", "professional"]):
-        return f"{user_prompt}, {', '.join(enhancements)}"
-    return user_prompt
-
 def generate_image(prompt):
     """Generate image from text prompt with enhanced quality"""
-    try:
-        # Enhance the prompt for better results
+    # Runs as a background job: errors are raised so the job ends as "failed" (see finish_job)
+    # and the next identical request retries instead of reattaching to the failure
+    with get_metrics().timer("enhance_prompt"):
         enhanced_prompt = enhance_image_prompt(prompt)
-        image = client.text_to_image(
-            enhanced_prompt,
-            model=IMAGE_MODEL
+    # Cache key covers the enhanced prompt, so repeat requests skip inference
+    return generate_image_bytes(client, enhanced_prompt, IMAGE_MODEL, fallbacks=FALLBACK_MODELS)
+
+def image_error_message(error):
+    """What to tell the user when an image job failed"""
+    if isinstance(error, RateLimitExceeded):
+        return str(error)
+    if is_quota_error(error):
+        return "I've reached my API quota. Please try again later."
+    return "Sorry, I couldn't create that image. Please try again."
+
+def chat_with_ai(messages):
+    """Send the conversation to AI and stream the response"""
+    try:
+        yield from stream_chat(
+            client,
+            messages,
+            CHAT_MODEL,
+            max_tokens=500,
+            fallbacks=CHAT_FALLBACK_MODELS
         )
-        return image
     except Exception as e:
-        error_msg = str(e)
-        if "402" in error_msg or "Payment Required" in error_msg:
-            return "error_quota"
+        yield f"I apologize, but I encountered an error: {str(e)}"
+
+def finish_job(msg, stopped=False):
+    """Turn a pending message into a regular one once its background job has finished or been stopped"""
+    message = job_message(msg, stopped)
+    # The message now holds everything it needs, so the job's result can leave memory
+    jobs.release(msg["job_id"])
+    return message
+
+def job_message(msg, stopped):
+    """The regular message that replaces a pending one"""
+    status = jobs.status(msg["job_id"])
+    if msg["kind"] == "chat" and (stopped or status in ("done", "cancelled")):
+        return {"role": "assistant", "content": jobs.partial(msg["job_id"]) or "(stopped)", "type": "text"}
+    if msg["kind"] == "image" and status == "failed":
+        try:
+            jobs.result(msg["job_id"])
+        except Exception as e:
+            return {"role": "assistant", "content": image_error_message(e), "type": "text"}
+    if msg["kind"] == "image" and status == "done":
+        image = jobs.result(msg["job_id"])
+        return {
+            "role": "assistant",
+            "content": "Here's your image!",
+            "type": "image",
+            "gallery_id": gallery.add(st.session_state.session_id, image, msg.get("prompt", ""), IMAGE_MODEL, kind="zeno")
+        }
+    if stopped or status == "cancelled":
+        return {"role": "assistant", "content": "Image generation cancelled.", "type": "text"}
+    return {"role": "assistant", "content": "Sorry, I lost track of that request. Please try again.", "type": "text"}
+
+@st.fragment(run_every=0.5)
+def pending_message(i):
+    """Poll the background job behind message i and show its progress"""
+    msg = st.session_state.messages[i]
+    status = jobs.status(msg["job_id"])
+
+    if status in ("pending", "running"):
+        if msg["kind"] == "chat":
+            text = jobs.partial(msg["job_id"])
+            content = text + "▌" if text else describe_wait("chat") or "Thinking..."
         else:
-            return f"error_{error_msg}"
+            # Show the expected queue time instead of failing when the image limiter is saturated
+            content = describe_wait("image") or "Creating your image..."
+        st.markdown(bubble_html("assistant", content), unsafe_allow_html=True)
+
+        stopped = st.button("Stop", key=f"cancel_{i}")
+        if not stopped:
+            return
+        jobs.cancel(msg["job_id"])
+    else:
+        stopped = False
 
-def chat_with_ai(message):
-    """Send message to AI and get response"""
-    try:
-        response = client.chat_completion(
-            messages=[{"role": "user", "content": message}],
-            model=CHAT_MODEL,
-            max_tokens=500
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"I apologize, but I encountered an error: {str(e)}"
+    # Finished (or stopped): store the result and redraw the whole chat
+    st.session_state.messages[i] = finish_job(msg, stopped)
+    st.rerun()
 
 def is_image_request(user_input):
     """Check if user wants to generate an image"""
-    image_keywords = [
-        "generate", "create", "make", "draw", "design",
-        "image", "picture", "photo", "portrait", "art",
-        "show me", "illustrate", "render", "visualize"
-    ]
-
-    # Check for keywords
-    user_lower = user_input.lower()
-    for keyword in image_keywords:
-        if keyword in user_lower:
-            return True
-    return False
+    # Local classifier (word cues with negation + hashed n-gram model), so "make sense",
+    # "art of war" or "show me how" no longer start an image generation
+    return intent_model.is_image_request(user_input)
+
+def load_earlier_images():
+    """Prepend the next page of this session's saved images to the restored history"""
+    rows = gallery.page(st.session_state.session_id, "zeno", offset=len(st.session_state.restored))
+    st.session_state.restored[:0] = reversed(rows)
+
+def show_restored_image(row):
+    """Draw one saved prompt/image pair from the gallery"""
+    st.markdown(message_html("user", row["prompt"]), unsafe_allow_html=True)
+    st.markdown(message_html("assistant", "Here's your image!"), unsafe_allow_html=True)
+    st.markdown('<div class="image-container">', unsafe_allow_html=True)
+    # Saved images are read back from disk per rerun instead of being held in session state
+    image = gallery.get(row["id"])
+    if st.toggle("Full size", key=f"full_saved_{row['id']}"):
+        st.image(image)
+    else:
+        st.image(gallery.preview(row["id"]))
+    st.download_button(
+        label="Download Image",
+        data=image,
+        file_name=f"zeno_{datetime.fromtimestamp(row['created']).strftime('%Y%m%d_%H%M%S')}.png",
+        mime="image/png",
+        key=f"download_saved_{row['id']}"
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def show_earlier_messages():
+    """Widen the history window by another page of older messages"""
+    st.session_state.history_shown += CHAT_HISTORY_WINDOW
+
+@st.fragment
+def show_message(i):
+    """Draw finished message i; its widgets (full size, download) only rerun this message"""
+    msg = st.session_state.messages[i]
+    st.markdown(message_html(msg["role"], msg["content"]), unsafe_allow_html=True)
+
+    # Messages only keep the gallery id; the bytes are read from its blob file when rendered
+    image = gallery.get(msg["gallery_id"]) if msg.get("type") == "image" else None
+    if image:
+        st.markdown('<div class="image-container">', unsafe_allow_html=True)
+        # Reruns ship a small preview; the full-resolution image only once the user expands it
+        if st.toggle("Full size", key=f"full_{i}"):
+            st.image(image)
+        else:
+            st.image(gallery.preview(msg["gallery_id"]))
+
+        # Download button (image is stored as PNG bytes, so nothing is re-encoded per rerun)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        st.download_button(
+            label="Download Image",
+            data=image,
+            file_name=f"zeno_{timestamp}.png",
+            mime="image/png",
+            key=f"download_{i}"  # Cached repeats can produce identical images
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    if msg.get("similar_to"):
+        # Earlier images may come from a fallback model, so say which one made it
+        st.caption(f"Made earlier with {msg.get('similar_model', IMAGE_MODEL)} for: {msg['similar_to']}")
+        if st.button("Generate a new one instead", key=f"regenerate_{i}"):
+            st.session_state.messages[i] = submit_image_job(msg["prompt"])
+            st.rerun()
+
+def similar_image_message(user_input):
+    """An image message reusing an earlier image for a near-identical prompt, or None"""
+    # Checked before any job is submitted, so a match costs no upstream call; the exact
+    # same prompt is left to the image cache, since regenerating it would return the same image
+    enhanced_prompt = enhance_image_prompt(user_input)
+    similar = find_similar_image(enhanced_prompt)
+    if similar is None or similar[1]["prompt"] == enhanced_prompt:
+        return None
+    image, match = similar
+    return {
+        "role": "assistant",
+        "content": f"A similar image already exists ({match['similarity']:.0%} match), here it is!",
+        "type": "image",
+        "gallery_id": gallery.add(st.session_state.session_id, image, user_input, match["model"], kind="zeno"),
+        "prompt": user_input,
+        "similar_to": match["prompt"],
+        "similar_model": match["model"]
+    }
+
+def submit_image_job(user_input):
+    """Start generating an image for a message and return its pending placeholder"""
+    # Asking for the same image again while it is still around attaches to the existing job
+    job_id = jobs.submit(generate_image, user_input, key=("image", user_input), lane="image")
+    return {"role": "assistant", "content": "", "type": "pending", "kind": "image", "job_id": job_id, "prompt": user_input}
+
+def show_turn(i):
+    """Draw message i: a polling placeholder while its job runs, the finished message otherwise"""
+    if st.session_state.messages[i].get("type") == "pending":
+        pending_message(i)
+    else:
+        show_message(i)
+
+@st.fragment
+def chat_input():
+    """Turns sent since the last full run plus the input form"""
+    # Sending a message only reruns this fragment, so the history above is not redrawn;
+    # the new turns move up into it on the next full run (e.g. when a reply finishes)
+    if not st.session_state.messages and not st.session_state.restored:
+        st.markdown("""
+        <div class="empty-state">
+            <h2>How can I help you today?</h2>
+        </div>
+        """, unsafe_allow_html=True)
+    # Filled in after the form so a message sent on this run shows up straight away
+    new_turns = st.container()
+
+    # Chat input (fixed at bottom)
+    with st.form(key="chat_form", clear_on_submit=True):
+        user_input = st.text_input(
+            "Message",
+            placeholder="Message Zeno...",
+            label_visibility="collapsed"
+        )
+
+        col1, col2 = st.columns([5, 1])
+        with col2:
+            send_button = st.form_submit_button("Send", type="primary", use_container_width=True)
+
+    if send_button and user_input:
+        # Add user message
+        st.session_state.messages.append({"role": "user", "content": user_input, "type": "text"})
+
+        # Check if user wants to generate an image
+        if is_image_request(user_input):
+            st.session_state.messages.append(similar_image_message(user_input) or submit_image_job(user_input))
+        else:
+            # Build the context on the script thread; the job streams the reply into its partial text
+            messages = st.session_state.chat_context.build(st.session_state.messages[:-1], user_input)
+            job_id = jobs.submit(chat_with_ai, messages, stream=True)
+            st.session_state.messages.append({"role": "assistant", "content": "", "type": "pending", "kind": "chat", "job_id": job_id})
+
+    with new_turns:
+        for i in range(st.session_state.history_end, len(st.session_state.messages)):
+            show_turn(i)
 
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "session_id" not in st.session_state:
+    # The session id lives in the URL, so reloading the page picks up the same gallery
+    sid = st.query_params.get("sid")
+    st.session_state.session_id = sid if is_session_id(sid) else uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.session_id
+if "restored" not in st.session_state:
+    # Saved images from earlier visits, oldest first; only one page is loaded up front
+    st.session_state.restored = []
+    st.session_state.restored_total = gallery.count(st.session_state.session_id, "zeno")
+    load_earlier_images()
+if "chat_context" not in st.session_state:
+    st.session_state.chat_context = ConversationContext()
+if "history_shown" not in st.session_state:
+    st.session_state.history_shown = CHAT_HISTORY_WINDOW
 
 # Header
 st.markdown("""
@@ -299,85 +502,27 @@ st.markdown("""
 # Chat area
 st.markdown('<div class="chat-area">', unsafe_allow_html=True)
 
-if not st.session_state.messages:
-    st.markdown("""
-    <div class="empty-state">
-        <h2>How can I help you today?</h2>
-    </div>
-    """, unsafe_allow_html=True)
-else:
-    for msg in st.session_state.messages:
-        if msg["role"] == "user":
-            st.markdown(f"""
-            <div class="message-container">
-                <div class="avatar user-avatar">U</div>
-                <div class="message-content">{msg['content']}</div>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-            <div class="message-container">
-                <div class="avatar ai-avatar">Z</div>
-                <div class="message-content">{msg['content']}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-            if msg.get("type") == "image" and msg.get("image"):
-                st.markdown('<div class="image-container">', unsafe_allow_html=True)
-                st.image(msg["image"])
-
-                # Download button
-                img_byte_arr = BytesIO()
-                msg["image"].save(img_byte_arr, format='PNG')
-                img_byte_arr = img_byte_arr.getvalue()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-                st.download_button(
-                    label="Download Image",
-                    data=img_byte_arr,
-                    file_name=f"zeno_{timestamp}.png",
-                    mime="image/png"
-                )
-                st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('</div>', unsafe_allow_html=True)
-
-# Chat input (fixed at bottom)
-with st.form(key="chat_form", clear_on_submit=True):
-    user_input = st.text_input(
-        "Message",
-        placeholder="Message Zeno...",
-        label_visibility="collapsed"
-    )
+if st.session_state.restored and len(st.session_state.messages) <= st.session_state.history_shown:
+    if len(st.session_state.restored) < st.session_state.restored_total:
+        st.button("Load earlier images", key="load_earlier", on_click=load_earlier_images)
+    for row in st.session_state.restored:
+        show_restored_image(row)
 
-    col1, col2 = st.columns([5, 1])
-    with col2:
-        send_button = st.form_submit_button("Send", type="primary", use_container_width=True)
+# Turns that arrived before this full run; newer ones are drawn by chat_input() until the next one
+st.session_state.history_end = len(st.session_state.messages)
+history_start = max(0, st.session_state.history_end - st.session_state.history_shown)
+if history_start:
+    st.button("Load earlier messages", key="load_earlier_messages", on_click=show_earlier_messages)
 
-if send_button and user_input:
-    # Add user message
-    st.session_state.messages.append({"role": "user", "content": user_input, "type": "text"})
+# Server-side cost of drawing the history (images are handed to the browser here)
+render_start = time.perf_counter()
+for i in range(history_start, st.session_state.history_end):
+    show_turn(i)
+get_metrics().observe("render", time.perf_counter() - render_start, app="zeno")
 
-    # Check if user wants to generate an image
-    if is_image_request(user_input):
-        st.session_state.messages.append({"role": "assistant", "content": "Creating your image...", "type": "text"})
+st.markdown('</div>', unsafe_allow_html=True)
 
-        with st.spinner("Generating high-quality image..."):
-            image = generate_image(user_input)
+chat_input()
 
-        if isinstance(image, str):
-            st.session_state.messages[-1]["content"] = "I've reached my API quota. Please try again later."
-        else:
-            st.session_state.messages[-1] = {
-                "role": "assistant",
-                "content": "Here's your image!",
-                "type": "image",
-                "image": image
-            }
-    else:
-        # Regular chat
-        with st.spinner("Thinking..."):
-            ai_response = chat_with_ai(user_input)
-        st.session_state.messages.append({"role": "assistant", "content": ai_response, "type": "text"})
-
-    st.rerun()
+show_gallery_search(st.session_state.session_id)
+show_metrics_panel()
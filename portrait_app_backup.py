@@ -1,27 +1,46 @@
 import streamlit as st
-from huggingface_hub import InferenceClient
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+import uuid
 from io import BytesIO
-import random
 
-# Load environment variables
+# Load environment variables (before the helper modules below read their settings)
 load_dotenv()
 
+from backends import get_backend
+from chat import ConversationContext, stream_chat
+from gallery import get_gallery, is_session_id, show_gallery_search
+from generation import generate_image_bytes, generate_images_as_prompts_arrive
+from jobs import get_job_executor
+from metrics import get_metrics, show_metrics_panel
+from models import CHAT_FALLBACK_MODELS, CHAT_MODEL, FALLBACK_MODELS, IMAGE_MODEL
+from prefetch import get_combination_sampler, get_prefetch_pool
+from rate_limit import describe_wait
+from session_images import get_session_image_store, make_preview
+from story import get_story_planner
+from storybook import write_storybook_pdf, write_storybook_zip
+
 # Configuration
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
-# Primary model
-MODEL_NAME = "black-forest-labs/FLUX.1-schnell"
-# Fallback models if quota exceeded
-FALLBACK_MODELS = [
-    "stabilityai/stable-diffusion-xl-base-1.0",
-    "runwayml/stable-diffusion-v1-5",
-    "CompVis/stable-diffusion-v1-4"
-]
 
-# Initialize HuggingFace client
-client = InferenceClient(token=HUGGINGFACE_TOKEN)
+# Maximum number of story pages generated at the same time
+STORY_MAX_WORKERS = int(os.getenv("STORY_MAX_WORKERS", "4"))
+
+# Shared inference backend: the pooled HuggingFace client, or the offline fake (INFERENCE_BACKEND=fake)
+client = get_backend(HUGGINGFACE_TOKEN)
+
+# Process-wide session file store; holds finished storybook exports (story pages live in the gallery)
+image_store = get_session_image_store()
+
+# Persistent gallery: story pages are saved there once, and session state keeps only their ids
+gallery = get_gallery()
+
+# Process-wide story planner with its plan cache
+story_planner = get_story_planner()
+
+# Storybook exports run as background jobs, keyed by the story they were built from
+jobs = get_job_executor()
 
 # Consistent character description (based on the reference image)
 BASE_CHARACTER = "a stylish man in his late 20s with a full brown beard, wearing trendy sunglasses, casual modern clothing"
@@ -84,10 +103,10 @@ DETAILS = [
 
 def generate_random_portrait():
     """Generate a random scenario for the same person"""
-    activity = random.choice(ACTIVITIES)
-    clothing = random.choice(CLOTHING)
-    setting = random.choice(SETTINGS)
-    detail = random.choice(DETAILS)
+    # Process-wide sampler, so no combination is handed out twice
+    activity, clothing, setting, detail = get_combination_sampler(
+        "portrait", ACTIVITIES, CLOTHING, SETTINGS, DETAILS
+    ).sample()
 
     prompt = f"{BASE_CHARACTER}, {clothing}, {activity}, {setting}, {detail}"
     return prompt
@@ -95,109 +114,122 @@ def generate_random_portrait():
 def generate_image(prompt):
     """Generate image from text prompt using InferenceClient"""
     try:
-        # Generate image using text_to_image
-        image = client.text_to_image(prompt, model=MODEL_NAME)
+        # Random scenarios from the prefetch pool, like any repeat prompt, come from the disk cache
+        image = generate_image_bytes(client, prompt, IMAGE_MODEL, fallbacks=FALLBACK_MODELS)
         return image
     except Exception as e:
         st.error(f"Error: {str(e)}")
         return None
 
-def generate_multiple_images(prompts_list):
-    """Generate multiple images from a list of prompts"""
-    images = []
-    for i, prompt in enumerate(prompts_list):
-        try:
-            with st.spinner(f"Generating image {i+1} of {len(prompts_list)}... ⏳"):
-                image = client.text_to_image(prompt, model=MODEL_NAME)
-                images.append(image)
-        except Exception as e:
-            st.error(f"Error generating image {i+1}: {str(e)}")
-            images.append(None)
+def prefetch_image(prompt):
+    """Render a random scenario ahead of time (runs on the prefetch thread)"""
+    generate_image_bytes(client, prompt, IMAGE_MODEL, fallbacks=FALLBACK_MODELS)
+
+# Random scenarios rendered while the image quota is idle, so Random then Generate is instant
+random_pool = get_prefetch_pool("portrait", generate_random_portrait, prefetch_image)
+
+def generate_multiple_images(prompts, num_pages=None):
+    """Generate multiple images in parallel, showing each page as soon as it is ready"""
+    # prompts is a list, or an iterable of (page index, prompt) still being produced when num_pages is given
+    if num_pages is None:
+        num_pages = len(prompts)
+        prompts = enumerate(prompts)
+    images = [None] * num_pages
+
+    # One placeholder per page so pages appear in page order whatever order they finish in
+    board = st.empty()
+    with board.container():
+        progress = st.progress(0.0, text=describe_wait("image") or f"Generating {num_pages} images... ⏳")
+        slots = []
+        for i in range(num_pages):
+            slot = st.empty()
+            slot.info(f"⏳ Generating page {i+1}...")
+            slots.append(slot)
+
+    done = 0
+    for i, image, error in generate_images_as_prompts_arrive(
+        client, prompts, IMAGE_MODEL, max_workers=STORY_MAX_WORKERS, fallbacks=FALLBACK_MODELS
+    ):
+        done += 1
+        if error is None:
+            images[i] = image
+            slots[i].image(make_preview(image), caption=f"Page {i+1}", use_container_width=True)
+        else:
+            slots[i].error(f"Error generating image {i+1}: {str(error)}")
+        progress.progress(done / num_pages, text=f"Generated {done} of {num_pages} images")
+
+    # The story gallery below takes over once every page is done
+    board.empty()
     return images
 
 def split_story_with_ai(full_story, num_pages):
     """Use AI to split a story into scenes for image generation with consistent character descriptions"""
-    try:
-        # Step 1: Extract character descriptions (short, concise)
-        character_prompt = f"""Analyze this story and list ALL characters with BRIEF but SPECIFIC descriptions.
-
-Story: {full_story}
-
-For each character, write ONE LINE with:
-- Name
-- Type/species with color (e.g., "light brown bunny", "green dinosaur", "orange turtle")
-- One key feature (e.g., "floppy ears", "long neck", "small shell")
-
-Format: [Name] the [color] [type] with [key feature]
-Example: Benny the light brown cottontail bunny with long floppy ears
-
-List all characters, one per line."""
-
-        char_response = client.chat_completion(
-            messages=[{"role": "user", "content": character_prompt}],
-            model="meta-llama/Llama-3.2-3B-Instruct",
-            max_tokens=300
-        )
-
-        character_descriptions = char_response.choices[0].message.content.strip()
-
-        # Show character descriptions to user
-        st.info("📝 Character Descriptions:")
-        st.text(character_descriptions)
-
-        # Step 2: Get scene actions only (what happens in each scene)
-        action_prompt = f"""Split this story into {num_pages} scenes. For EACH scene, write ONLY what the characters are DOING and WHERE they are.
-
-Story: {full_story}
-
-Format (one per line):
-Page 1: [brief action and setting]
-Page 2: [brief action and setting]
-
-Example:
-Page 1: playing in a sunny forest clearing
-Page 2: meeting a new friend by a pond
-Page 3: searching for food together in the meadow
-
-Provide exactly {num_pages} scenes."""
-
-        action_response = client.chat_completion(
-            messages=[{"role": "user", "content": action_prompt}],
-            model="meta-llama/Llama-3.2-3B-Instruct",
-            max_tokens=500
-        )
-
-        action_text = action_response.choices[0].message.content
-
-        # Parse actions
-        actions = []
-        for line in action_text.split('\n'):
-            line = line.strip()
-            if line and 'Page' in line and ':' in line:
-                action = line.split(':', 1)[1].strip()
-                if action and len(action) > 5:
-                    actions.append(action)
-
-        if len(actions) < num_pages:
-            st.warning(f"Only got {len(actions)} actions, padding to {num_pages}")
-            while len(actions) < num_pages:
-                actions.append("continuing their adventure in a beautiful scene")
-
-        actions = actions[:num_pages]
-
-        # Step 3: Manually combine character descriptions with actions
-        scenes = []
-        for i, action in enumerate(actions):
-            # Build complete scene with ALL characters + action
-            scene = f"{character_descriptions}, {action}, children's book illustration, cute cartoon style, vibrant colors, consistent character design"
-            scenes.append(scene)
-            st.write(f"**Scene {i+1}:** {scene[:100]}...")
-
-        return scenes
-
-    except Exception as e:
-        st.error(f"Error splitting story: {str(e)}")
-        return None
+    # Characters and the scene list are requested concurrently; iterating the result yields
+    # (page index, scene) as each "Page N:" line streams in. Repeat stories come from the plan cache.
+    return story_planner.stream(client, full_story, num_pages, CHAT_MODEL, fallbacks=CHAT_FALLBACK_MODELS)
+
+def show_story_plan(plan):
+    """Show the character descriptions and scenes the AI came up with"""
+    st.info("📝 Character Descriptions:")
+    st.text("\n".join(plan.characters))
+
+    if not plan.complete:
+        st.warning(f"Some scenes were missing, padded to {len(plan.actions)} pages")
+
+    with st.expander("📝 View AI-Generated Scenes"):
+        for i, scene in enumerate(plan.scenes()):
+            st.write(f"**Page {i+1}:** {scene}")
+
+def store_images(images, prompts):
+    """Save generated pages to the gallery and return their gallery ids (None for failed pages)"""
+    # Each story is saved to the gallery as one album, one position per page
+    st.session_state.story_album = uuid.uuid4().hex
+    return [save_page(i, image, prompt) if image else None for i, (image, prompt) in enumerate(zip(images, prompts))]
+
+def save_page(i, image, prompt):
+    """Record one story page in the gallery under the current story's album and return its id"""
+    return gallery.add(st.session_state.session_id, image, prompt, IMAGE_MODEL, kind="story",
+                       album=st.session_state.story_album, position=i)
+
+def restore_last_story():
+    """Bring back the session's most recent story from the gallery after a reload"""
+    # Pages that never generated were not saved, so only the saved ones come back
+    rows = gallery.latest_album(st.session_state.session_id, "story")
+    if rows:
+        st.session_state.story_album = rows[0]["album"]
+        st.session_state.generated_images = [row["id"] for row in rows]
+        st.session_state.story_prompts = [row["prompt"] for row in rows]
+
+def page_image(ref):
+    """PNG bytes of a story page, read from its gallery blob (None for a failed page)"""
+    return gallery.get(ref) if ref is not None else None
+
+def build_storybook(session_id, export_format, refs, captions):
+    """Assemble every page and its caption into one PDF or ZIP (runs as a background job)"""
+    # The writers pull pages from the image store one at a time, so only one image is held.
+    # The file goes to the session image store, so the job's result is only its reference
+    pages = ((page_image(ref), caption) for ref, caption in zip(refs, captions))
+    out = BytesIO()
+    if export_format == "PDF":
+        write_storybook_pdf(out, pages)
+    else:
+        write_storybook_zip(out, pages)
+    return image_store.put(session_id, out.getvalue(), suffix=export_format.lower())
+
+@st.fragment(run_every=0.5)
+def wait_for_storybook(job_id):
+    """Poll the storybook export and redraw the page once it is ready"""
+    if jobs.status(job_id) in ("pending", "running"):
+        st.caption("📚 Preparing your storybook...")
+        return
+    st.rerun()
+
+# Identify this browser session for the image store; the id lives in the URL so a reload restores the gallery
+if "session_id" not in st.session_state:
+    sid = st.query_params.get("sid")
+    st.session_state.session_id = sid if is_session_id(sid) else uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.session_id
+    restore_last_story()
 
 # Sidebar AI Chatbox
 with st.sidebar:
@@ -207,23 +239,35 @@ with st.sidebar:
     # Initialize chat history
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
+        st.session_state.chat_context = ConversationContext()
 
     # Chat input
     user_message = st.text_input("Your message:", key="chat_input", placeholder="Type your message here...")
 
     if st.button("Send", use_container_width=True):
         if user_message:
-            # Add user message to history
+            # Build the request from earlier turns (within the token budget), then record the new one
+            messages = st.session_state.chat_context.build(st.session_state.chat_history, user_message)
             st.session_state.chat_history.append({"role": "user", "content": user_message})
 
             try:
-                # Generate AI response using HuggingFace
-                response = client.chat_completion(
-                    messages=[{"role": "user", "content": user_message}],
-                    model="meta-llama/Llama-3.2-3B-Instruct",
-                    max_tokens=500
-                )
-                ai_response = response.choices[0].message.content
+                # Stream the AI response from HuggingFace as it is generated
+                reply = st.empty()
+                notice = describe_wait("chat")
+                if notice:
+                    reply.caption(notice)
+                ai_response = ""
+                for token in stream_chat(
+                    client,
+                    messages,
+                    CHAT_MODEL,
+                    max_tokens=500,
+                    fallbacks=CHAT_FALLBACK_MODELS
+                ):
+                    ai_response += token
+                    reply.markdown(f"**AI:** {ai_response}▌")
+                # The chat history below shows the finished response
+                reply.empty()
 
                 # Add AI response to history
                 st.session_state.chat_history.append({"role": "assistant", "content": ai_response})
@@ -246,6 +290,7 @@ with st.sidebar:
     # Clear chat button
     if st.button("Clear Chat", use_container_width=True):
         st.session_state.chat_history = []
+        st.session_state.chat_context = ConversationContext()
         st.rerun()
 
     st.divider()
@@ -261,7 +306,7 @@ mode = st.radio("Generation Mode:", ["Single Image", "Multiple Images (Story)"],
 
 # Handle random prompt button first (before text area is created)
 if st.session_state.get("random_clicked", False):
-    st.session_state.prompt_value = generate_random_portrait()
+    st.session_state.prompt_value = random_pool.take() or generate_random_portrait()
     st.session_state.random_clicked = False
 
 # Initialize session state for prompt if not exists
@@ -327,14 +372,15 @@ else:
 if generate_button:
     if mode == "Single Image":
         if prompt:
-            with st.spinner("Generating portrait... ⏳"):
+            with st.spinner(describe_wait("image") or "Generating portrait... ⏳"):
                 image = generate_image(prompt)
 
                 if image:
                     st.success("Portrait generated successfully! ✨")
-                    st.image(image, use_container_width=True)
+                    with get_metrics().timer("render", app="story"):
+                        st.image(image, use_container_width=True)
 
-                    # Store image in session state for download
+                    # Store the PNG bytes in session state for download
                     st.session_state.generated_image = image
                     st.session_state.generated_images = None  # Clear multi-image state
                 else:
@@ -353,7 +399,7 @@ if generate_button:
                     images = generate_multiple_images(prompts_list)
 
                     # Store images in session state
-                    st.session_state.generated_images = images
+                    st.session_state.generated_images = store_images(images, prompts_list)
                     st.session_state.story_prompts = prompts_list
                     st.session_state.generated_image = None  # Clear single image state
 
@@ -365,24 +411,23 @@ if generate_button:
 
         else:  # Auto-Split mode
             if full_story:
-                # Step 1: Split story with AI
-                with st.spinner("AI is splitting your story into scenes... 🤖"):
-                    scenes = split_story_with_ai(full_story, num_pages)
-
-                if scenes:
+                # Pages start generating as soon as their scene is written, while the rest of the plan streams in
+                st.info(describe_wait("chat") or f"AI is splitting your story into {num_pages} scenes and painting each one as it arrives... 🤖")
+                try:
+                    plan_stream = split_story_with_ai(full_story, num_pages)
+                    images = generate_multiple_images(plan_stream, num_pages)
+                    plan = plan_stream.plan
+                except Exception as e:
+                    st.error(f"Error splitting story: {str(e)}")
+                    plan = None
+
+                if plan:
+                    scenes = plan.scenes()
                     st.success(f"AI created {len(scenes)} scene descriptions!")
-
-                    # Show the scenes to the user
-                    with st.expander("📝 View AI-Generated Scenes"):
-                        for i, scene in enumerate(scenes):
-                            st.write(f"**Page {i+1}:** {scene}")
-
-                    # Step 2: Generate images from scenes
-                    st.info(f"Now generating {len(scenes)} images...")
-                    images = generate_multiple_images(scenes)
+                    show_story_plan(plan)
 
                     # Store images in session state
-                    st.session_state.generated_images = images
+                    st.session_state.generated_images = store_images(images, scenes)
                     st.session_state.story_prompts = scenes
                     st.session_state.generated_image = None  # Clear single image state
 
@@ -394,18 +439,13 @@ if generate_button:
 
 # Display and download for single image
 if "generated_image" in st.session_state and st.session_state.generated_image:
-    # Convert PIL image to bytes
-    img_byte_arr = BytesIO()
-    st.session_state.generated_image.save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
-
     # Generate filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"portrait_{timestamp}.png"
 
     st.download_button(
         label="📥 Download Portrait",
-        data=img_byte_arr,
+        data=st.session_state.generated_image,  # Already PNG bytes, no re-encode per rerun
         file_name=filename,
         mime="image/png"
     )
@@ -415,24 +455,62 @@ if "generated_images" in st.session_state and st.session_state.generated_images:
     st.divider()
     st.subheader("📚 Your Story Images")
 
-    for i, (image, prompt) in enumerate(zip(st.session_state.generated_images, st.session_state.story_prompts)):
+    # Export of the whole story, built only when asked for. The session keeps the job id
+    # while it runs, then just a reference to the finished file in the image store
+    refs, captions = st.session_state.generated_images, st.session_state.story_prompts
+    export_format = st.radio("Storybook format:", ["PDF", "ZIP"], horizontal=True, key="storybook_format")
+    # Keyed on page content rather than this session's gallery ids, so the same story
+    # (and format) requested from another session attaches to the same build
+    pages = tuple(gallery.sha256(ref) if ref is not None else None for ref in refs)
+    export_key = ("storybook", export_format, pages, tuple(captions))
+    job_key, export_job = st.session_state.get("storybook_job", (None, None))
+    export_status = jobs.status(export_job) if job_key == export_key else None
+    if export_status == "done":
+        # The result is only a file reference, so the job is left for other sessions to reuse
+        st.session_state.storybook_file = (export_key, jobs.result(export_job))
+        del st.session_state.storybook_job
+    file_key, file_ref = st.session_state.get("storybook_file", (None, None))
+    storybook = image_store.get(file_ref) if file_key == export_key else None
+    if storybook:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        st.download_button(
+            label=f"📚 Download Storybook ({export_format})",
+            data=storybook,
+            file_name=f"storybook_{timestamp}.{export_format.lower()}",
+            mime="application/pdf" if export_format == "PDF" else "application/zip",
+            key="download_storybook"
+        )
+    elif export_status in ("pending", "running"):
+        wait_for_storybook(export_job)
+    else:
+        if export_status == "failed":
+            st.error("Couldn't build the storybook. Please try again.")
+        if st.button(f"📚 Build Storybook ({export_format})", key="build_storybook"):
+            st.session_state.storybook_job = (
+                export_key,
+                jobs.submit(build_storybook, st.session_state.session_id, export_format, refs, captions,
+                            key=export_key, lane="image")
+            )
+            st.rerun()
+
+    for i, (ref, prompt) in enumerate(zip(st.session_state.generated_images, st.session_state.story_prompts)):
         st.markdown(f"### Page {i+1}")
         st.caption(prompt)
 
+        image = page_image(ref)
         if image:
-            st.image(image, use_container_width=True)
-
-            # Individual download button
-            img_byte_arr = BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
+            # Reruns ship a small preview; the full-resolution page only once the user expands it
+            full_size = st.toggle("Full size", key=f"full_{i}")
+            with get_metrics().timer("render", app="story"):
+                st.image(image if full_size else gallery.preview(ref), use_container_width=True)
 
+            # Individual download button (image is already PNG bytes)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"story_page_{i+1}_{timestamp}.png"
 
             st.download_button(
                 label=f"📥 Download Page {i+1}",
-                data=img_byte_arr,
+                data=image,
                 file_name=filename,
                 mime="image/png",
                 key=f"download_{i}"
@@ -440,4 +518,15 @@ if "generated_images" in st.session_state and st.session_state.generated_images:
         else:
             st.error(f"Failed to generate Page {i+1}")
 
+            # Retry just this page without regenerating the rest of the story
+            if st.button(f"🔁 Retry Page {i+1}", key=f"retry_{i}"):
+                with st.spinner(describe_wait("image") or f"Regenerating page {i+1}... ⏳"):
+                    image = generate_image(prompt)
+                if image:
+                    st.session_state.generated_images[i] = save_page(i, image, prompt)
+                    st.rerun()
+
         st.divider()
+
+show_gallery_search(st.session_state.session_id)
+show_metrics_panel()
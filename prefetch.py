@@ -0,0 +1,139 @@
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from metrics import get_metrics
+from rate_limit import get_rate_limiter
+
+# Configuration
+PREFETCH_POOL_SIZE = int(os.getenv("PREFETCH_POOL_SIZE", "2"))  # Random prompts rendered ahead (0 turns it off)
+PREFETCH_MIN_TOKENS = float(os.getenv("PREFETCH_MIN_TOKENS", "2"))  # Image limiter tokens kept free for users
+PREFETCH_IDLE_POLL = 2.0  # Seconds between checks while the quota is busy
+PREFETCH_RETRY_DELAY = 30.0  # Seconds to back off after a failed render
+
+
+class CombinationSampler:
+    """Draws combinations of one item per list without repeating any until all have been drawn"""
+    # Combinations are numbered in mixed radix and drawn by rejection against the
+    # numbers already used, so memory grows only with the draws actually made
+
+    def __init__(self, *choices, seed=None):
+        self.choices = [list(c) for c in choices]
+        self.total = math.prod(len(c) for c in self.choices)
+        self._rng = random.Random(seed)
+        self._used = set()
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if len(self._used) >= self.total:
+                self._used.clear()  # Every combination has been seen; start a new round
+            while True:
+                number = self._rng.randrange(self.total)
+                if number not in self._used:
+                    self._used.add(number)
+                    break
+        combination = []
+        for items in reversed(self.choices):
+            number, index = divmod(number, len(items))
+            combination.append(items[index])
+        return tuple(reversed(combination))
+
+
+class PrefetchPool:
+    """Keeps a few random prompts rendered ahead of time while the image quota is idle"""
+    # render() goes through the image cache, so the pool only holds prompts: generating a
+    # prompt it handed out is a cache hit. A background thread, started by the first
+    # take(), tops the pool up only while the image limiter has spare tokens, so
+    # prefetching never queues ahead of users or spends quota before anyone uses Random
+
+    def __init__(self, name, make_prompt, render, size=PREFETCH_POOL_SIZE):
+        self.name = name
+        self.make_prompt = make_prompt
+        self.render = render
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._ready = deque()  # Prompts whose image is in the cache, waiting to be handed out
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._filler = None
+
+    def take(self):
+        """Hand out a prompt whose image is already rendered, or None when the pool is empty"""
+        with self._lock:
+            if self._filler is None and self.size > 0:
+                self._filler = threading.Thread(target=self._fill, name=f"prefetch-{self.name}", daemon=True)
+                self._filler.start()
+            if not self._ready:
+                self.misses += 1
+                get_metrics().count("prefetch", pool=self.name, result="miss")
+                return None
+            prompt = self._ready.popleft()
+            self.hits += 1
+        get_metrics().count("prefetch", pool=self.name, result="hit")
+        self._wake.set()
+        return prompt
+
+    def _idle(self):
+        stats = get_rate_limiter("image").stats()
+        return stats["paused_for"] == 0 and stats["tokens"] >= PREFETCH_MIN_TOKENS
+
+    def _fill(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                full = len(self._ready) >= self.size
+            if full:
+                self._wake.wait()
+                continue
+            if not self._idle():
+                time.sleep(PREFETCH_IDLE_POLL)
+                continue
+
+            prompt = self.make_prompt()
+            try:
+                self.render(prompt)
+            except Exception:
+                get_metrics().count("prefetch", pool=self.name, result="error")
+                time.sleep(PREFETCH_RETRY_DELAY)
+                continue
+            with self._lock:
+                self._ready.append(prompt)
+
+    def stats(self):
+        """Return pool state for the admin/debug views"""
+        with self._lock:
+            return {"ready": len(self._ready), "size": self.size, "hits": self.hits, "misses": self.misses}
+
+
+_samplers = {}
+_pools = {}
+_registry_lock = threading.Lock()
+
+
+def get_combination_sampler(name, *choices):
+    """Return the process-wide sampler for name, created from choices on first use"""
+    with _registry_lock:
+        if name not in _samplers:
+            _samplers[name] = CombinationSampler(*choices)
+        return _samplers[name]
+
+
+def prefetch_stats():
+    """Return every pool's state for the admin/debug views"""
+    with _registry_lock:
+        pools = dict(_pools)
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+def get_prefetch_pool(name, make_prompt, render):
+    """Return the process-wide prefetch pool for name, started on first use"""
+    # Streamlit re-runs the app script, so only the first run's callables are kept
+    with _registry_lock:
+        if name not in _pools:
+            _pools[name] = PrefetchPool(name, make_prompt, render)
+        return _pools[name]
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+from image_cache import CACHE_DIR
+from prompts import QUALITY_TERMS
+
+# Configuration
+# Minimum Jaccard similarity of canonical prompts to offer an existing image (0 turns it off)
+SIMILAR_PROMPT_THRESHOLD = float(os.getenv("SIMILAR_PROMPT_THRESHOLD", "0.8"))
+# Share of each tag's words and word pairs that must appear in the other prompt
+SIMILAR_TAG_THRESHOLD = float(os.getenv("SIMILAR_TAG_THRESHOLD", "0.5"))
+PROMPT_INDEX_FILE = os.getenv("PROMPT_INDEX_FILE", os.path.join(CACHE_DIR, "prompts.jsonl"))
+
+# 16 bands of 4 rows: prompts around 0.5 similarity or more share a band with high probability
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # Fixed seed so signatures are stable across restarts
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+ARTICLES = {"a", "an", "the"}
+_TAG_SEPARATOR = re.compile(r"[,;|\n]+")
+_NON_WORD = re.compile(r"[^\w\s]+")
+_QUALITY_TAGS = {" ".join(term.split()) for term in QUALITY_TERMS}
+
+
+def singular(word):
+    """Crude plural folding, so "mountains" and "mountain" compare equal"""
+    if len(word) <= 3 or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("xes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def canonicalize_prompt(prompt):
+    """Normalize case, whitespace, punctuation, articles, plurals, tag order and enhancement terms"""
+    # "A sunset over mountains, digital art" and "digital art, sunset over the mountain"
+    # both become "digital art, sunset over mountain"
+    tags = set()
+    for tag in _TAG_SEPARATOR.split(prompt.lower()):
+        tag = " ".join(w for w in _NON_WORD.sub(" ", tag).split() if w not in ARTICLES)
+        if tag and tag not in _QUALITY_TAGS:
+            tags.add(" ".join(singular(w) for w in tag.split()))
+    return ", ".join(sorted(tags))
+
+
+def shingles(canonical):
+    """Words plus in-tag word pairs, so phrases matter but tag order does not"""
+    result = set()
+    for tag in canonical.split(", "):
+        words = tag.split()
+        result.update(words)
+        result.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    result.discard("")
+    return result
+
+
+def minhash(items):
+    """MinHash signature of a set of strings"""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in items]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def tags_covered(tags, other, threshold):
+    """Every tag has at least threshold of its shingles somewhere in the other prompt's shingles"""
+    # A long prompt can score high overall while one tag (e.g. the lighting) was swapped for
+    # another; comparing against the whole other prompt still lets tags merge or split
+    return all(len(tag & other) / len(tag) >= threshold for tag in tags if tag)
+
+
+def tag_shingles(canonical):
+    return [shingles(tag) for tag in canonical.split(", ")]
+
+
+class PromptIndex:
+    """MinHash/LSH index of prompts that already have an image in the cache"""
+    # LSH buckets only narrow down candidates; the exact Jaccard similarity of
+    # their shingle sets decides. Entries are appended to a JSONL file so the
+    # index survives restarts alongside the image cache it points into; entries
+    # whose image has left the cache are dropped with a "forget" line.
+
+    def __init__(self, path=PROMPT_INDEX_FILE, threshold=SIMILAR_PROMPT_THRESHOLD, tag_threshold=SIMILAR_TAG_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.tag_threshold = tag_threshold
+        self._lock = threading.Lock()
+        self._entries = []
+        self._seen = set()  # (canonical prompt, params) already indexed
+        self._buckets = {}  # (params, band, band signature) -> entry positions
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        forgotten = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if "forget" in entry:
+                        forgotten += self._remove(entry["forget"])
+                    else:
+                        self._insert(entry)
+                except (ValueError, KeyError):
+                    continue  # A line cut short by a crash
+        if forgotten:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the file with only the live entries"""
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self._entries:
+                if entry is not None:
+                    record = {k: entry[k] for k in ("prompt", "model", "key", "params")}
+                    f.write(json.dumps(record) + "\n")
+        os.replace(tmp, self.path)
+
+    def _insert(self, entry):
+        canonical = canonicalize_prompt(entry["prompt"])
+        items = shingles(canonical)
+        if not items or (canonical, entry["params"]) in self._seen:
+            return False
+        self._seen.add((canonical, entry["params"]))
+        position = len(self._entries)
+        self._entries.append({**entry, "canonical": canonical, "shingles": items, "tags": tag_shingles(canonical)})
+        for key in self._bucket_keys(entry["params"], items):
+            self._buckets.setdefault(key, []).append(position)
+        return True
+
+    def _bucket_keys(self, params_key, items):
+        signature = minhash(items)
+        return [(params_key, band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def _remove(self, cache_key):
+        """Drop the entries pointing at cache_key and return how many there were"""
+        removed = 0
+        for position, entry in enumerate(self._entries):
+            if entry is None or entry["key"] != cache_key:
+                continue
+            self._entries[position] = None
+            self._seen.discard((entry["canonical"], entry["params"]))
+            for key in self._bucket_keys(entry["params"], entry["shingles"]):
+                bucket = self._buckets[key]
+                bucket.remove(position)
+                if not bucket:
+                    del self._buckets[key]
+            removed += 1
+        return removed
+
+    def add(self, prompt, model, cache_key, **params):
+        """Remember that the image cache holds an image for this prompt"""
+        entry = {"prompt": prompt, "model": model, "key": cache_key, "params": json.dumps(params, sort_keys=True)}
+        with self._lock:
+            if not self._insert(entry):
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def forget(self, cache_key):
+        """Stop offering an image that is no longer in the cache (e.g. evicted)"""
+        with self._lock:
+            if not self._remove(cache_key):
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"forget": cache_key}) + "\n")
+
+    def find(self, prompt, threshold=None, **params):
+        """Indexed entries similar to prompt (same params), best first, as dicts with a similarity"""
+        threshold = self.threshold if threshold is None else threshold
+        if threshold <= 0:
+            return []
+        canonical = canonicalize_prompt(prompt)
+        items = shingles(canonical)
+        if not items:
+            return []
+        tags = tag_shingles(canonical)
+        params_key = json.dumps(params, sort_keys=True)
+        bucket_keys = self._bucket_keys(params_key, items)
+        with self._lock:
+            candidates = set()
+            for key in bucket_keys:
+                candidates.update(self._buckets.get(key, ()))
+            matches = []
+            for position in candidates:
+                entry = self._entries[position]
+                similarity = jaccard(items, entry["shingles"])
+                if (similarity >= threshold and tags_covered(tags, entry["shingles"], self.tag_threshold)
+                        and tags_covered(entry["tags"], items, self.tag_threshold)):
+                    matches.append({"prompt": entry["prompt"], "model": entry["model"], "key": entry["key"],
+                                    "similarity": similarity})
+        return sorted(matches, key=lambda m: m["similarity"], reverse=True)
+
+    def stats(self):
+        """Return index size for the admin/debug views"""
+        with self._lock:
+            return {"prompts": len(self._seen), "buckets": len(self._buckets), "threshold": self.threshold,
+                    "tag_threshold": self.tag_threshold}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_prompt_index():
+    """Return the process-wide near-duplicate prompt index"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PromptIndex()
+        return _index
@@ -0,0 +1,19 @@
+# Professional photography terms enhance_image_prompt adds for realistic results
+QUALITY_TERMS = [
+    "ultra realistic",
+    "8k uhd",
+    "high quality",
+    "professional photography",
+    "detailed",
+    "sharp focus",
+    "natural lighting",
+    "depth of field"
+]
+
+
+def enhance_image_prompt(user_prompt):
+    """Enhance user prompt for better image generation"""
+    # Check if prompt already has quality terms
+    if not any(term in user_prompt.lower() for term in ["realistic", "quality", "4k", "8k", "professional"]):
+        return f"{user_prompt}, {', '.join(QUALITY_TERMS)}"
+    return user_prompt
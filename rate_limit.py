@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+# Configuration (requests per minute and burst size for each kind of upstream call)
+IMAGE_RATE_PER_MIN = float(os.getenv("IMAGE_RATE_PER_MIN", "30"))
+IMAGE_BURST = int(os.getenv("IMAGE_BURST", "5"))
+CHAT_RATE_PER_MIN = float(os.getenv("CHAT_RATE_PER_MIN", "60"))
+CHAT_BURST = int(os.getenv("CHAT_BURST", "10"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))  # Longest a caller will queue
+BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "60"))
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller would have to wait longer than it is willing to"""
+
+    def __init__(self, wait):
+        super().__init__(f"Too many requests right now, please try again in {wait:.0f}s")
+        self.wait = wait
+
+
+class TokenBucket:
+    """Token bucket that callers queue on, with adaptive backoff on quota responses"""
+    # Tokens may go negative: each caller reserves its slot and sleeps until it is due,
+    # which keeps waiters roughly first-come first-served without a separate queue
+
+    def __init__(self, rate_per_min, burst):
+        self.max_rate = rate_per_min / 60
+        self.rate = self.max_rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_for(self, tokens, now):
+        return max(0.0, -tokens / self.rate, self._paused_until - now)
+
+    def estimate_wait(self):
+        """Seconds a new caller would wait right now, for showing in the UI"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._wait_for(self._tokens - 1, now)
+
+    def acquire(self, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Block until a request may be sent; returns how long we waited"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_for(self._tokens - 1, now)
+            if wait > max_wait:
+                raise RateLimitExceeded(wait)
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+        # Honour any backoff that started while we were queued
+        while True:
+            with self._lock:
+                paused = self._paused_until - time.monotonic()
+            if paused <= 0:
+                return wait
+            time.sleep(paused)
+            wait += paused
+
+    def penalize(self):
+        """Provider said we are over quota: halve the rate and pause with exponential backoff"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self._backoff = min(BACKOFF_MAX, max(1.0, self._backoff * 2))
+            self._paused_until = max(self._paused_until, now + self._backoff)
+
+    def reward(self):
+        """A request went through: creep back towards the configured rate"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            self._backoff = 0.0
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "rate_per_min": self.rate * 60,
+                "max_rate_per_min": self.max_rate * 60,
+                "tokens": self._tokens,
+                "paused_for": max(0.0, self._paused_until - now),
+            }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(kind):
+    """Return the process-wide bucket for "image" or "chat" calls"""
+    with _buckets_lock:
+        if kind not in _buckets:
+            if kind == "image":
+                _buckets[kind] = TokenBucket(IMAGE_RATE_PER_MIN, IMAGE_BURST)
+            else:
+                _buckets[kind] = TokenBucket(CHAT_RATE_PER_MIN, CHAT_BURST)
+        return _buckets[kind]
+
+
+def describe_wait(kind):
+    """Queue notice for the UI, or None when a request would go out straight away"""
+    wait = get_rate_limiter(kind).estimate_wait()
+    if wait < 1:
+        return None
+    return f"High demand right now - your request starts in about {wait:.0f}s ⏳"
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, features
+
+# Configuration
+SESSION_IMAGE_DIR = os.getenv("SESSION_IMAGE_DIR", ".session_images")
+SESSION_MEMORY_MB = int(os.getenv("SESSION_IMAGE_MEMORY_MB", "32"))
+GLOBAL_MEMORY_MB = int(os.getenv("SESSION_IMAGE_GLOBAL_MEMORY_MB", "512"))
+SESSION_IMAGE_TTL_HOURS = int(os.getenv("SESSION_IMAGE_TTL_HOURS", "72"))
+PREVIEW_MAX_PX = int(os.getenv("PREVIEW_MAX_PX", "384"))  # Longest side of history/gallery previews
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+# WebP when this Pillow build supports it, JPEG otherwise
+PREVIEW_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+
+def make_preview(data, max_px=PREVIEW_MAX_PX, quality=PREVIEW_QUALITY):
+    """Encode a small WebP/JPEG rendition of PNG bytes"""
+    image = Image.open(BytesIO(data))
+    image.thumbnail((max_px, max_px))
+    if PREVIEW_FORMAT == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    out = BytesIO()
+    image.save(out, format=PREVIEW_FORMAT, quality=quality)
+    return out.getvalue()
+
+
+class SessionImageStore:
+    """Keeps session images on disk plus a byte-budgeted in-memory LRU of them"""
+    # Bytes are written through to disk on put(), so evicting from memory just
+    # drops the entry and get() reloads it lazily the next time it is rendered
+
+    def __init__(self, store_dir=SESSION_IMAGE_DIR, session_budget=SESSION_MEMORY_MB * 1024 * 1024,
+                 global_budget=GLOBAL_MEMORY_MB * 1024 * 1024, ttl_hours=SESSION_IMAGE_TTL_HOURS):
+        self.store_dir = store_dir
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # ref -> bytes, least recently used first
+        self._session_bytes = {}  # session id -> bytes held in memory
+        self._total_bytes = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._prune(ttl_hours * 3600)
+
+    def _prune(self, max_age):
+        """Delete spilled images from sessions that are long gone"""
+        cutoff = time.time() - max_age
+        for session_id in os.listdir(self.store_dir):
+            session_dir = os.path.join(self.store_dir, session_id)
+            if not os.path.isdir(session_dir):
+                continue
+            for name in os.listdir(session_dir):
+                path = os.path.join(session_dir, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            if not os.listdir(session_dir):
+                os.rmdir(session_dir)
+
+    def _path(self, ref):
+        session_id, image_id = ref.split("/", 1)
+        if image_id.endswith("#preview"):
+            return os.path.join(self.store_dir, session_id, f"{image_id[:-8]}.preview.{PREVIEW_FORMAT.lower()}")
+        if "." in image_id:
+            return os.path.join(self.store_dir, session_id, image_id)
+        return os.path.join(self.store_dir, session_id, f"{image_id}.png")
+
+    def _remember(self, ref, data):
+        session_id = ref.split("/", 1)[0]
+        self._memory[ref] = data
+        self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + len(data)
+        self._total_bytes += len(data)
+
+        # Trim this session back under its own budget first, then the whole process
+        for old_ref in [r for r in self._memory if r.startswith(f"{session_id}/")]:
+            if self._session_bytes[session_id] <= self.session_budget or old_ref == ref:
+                break
+            self._forget(old_ref)
+        while self._total_bytes > self.global_budget and len(self._memory) > 1:
+            self._forget(next(iter(self._memory)))
+
+    def _forget(self, ref):
+        data = self._memory.pop(ref)
+        session_id = ref.split("/", 1)[0]
+        self._session_bytes[session_id] -= len(data)
+        if not self._session_bytes[session_id]:
+            del self._session_bytes[session_id]
+        self._total_bytes -= len(data)
+
+    def put(self, session_id, data, suffix=None):
+        """Store image bytes for a session and return a compact reference to keep in session state"""
+        # Other files (e.g. a storybook PDF) pass their suffix; images default to .png
+        ref = f"{session_id}/{uuid.uuid4().hex}" + (f".{suffix}" if suffix else "")
+        path = self._path(ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._remember(ref, data)
+        return ref
+
+    def get(self, ref):
+        """Return image bytes for a reference, loading spilled images from disk on demand"""
+        with self._lock:
+            if ref in self._memory:
+                self._memory.move_to_end(ref)
+                return self._memory[ref]
+        try:
+            with open(self._path(ref), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if ref not in self._memory:
+                self._remember(ref, data)
+        return data
+
+    def preview(self, ref):
+        """Return a small preview of an image, rendering and caching it on first use"""
+        # Previews share the memory LRU and sit next to the full image on disk, so
+        # reruns only ever ship the small rendition to the browser
+        preview_ref = f"{ref}#preview"
+        data = self.get(preview_ref)
+        if data is not None:
+            return data
+        full = self.get(ref)
+        if full is None:
+            return None
+        data = make_preview(full)
+        with open(self._path(preview_ref), "wb") as f:
+            f.write(data)
+        with self._lock:
+            if preview_ref not in self._memory:
+                self._remember(preview_ref, data)
+        return data
+
+    def stats(self):
+        """Return memory usage for the admin/debug views"""
+        with self._lock:
+            return {
+                "images_in_memory": len(self._memory),
+                "memory_bytes": self._total_bytes,
+                "sessions_in_memory": len(self._session_bytes),
+                "global_budget": self.global_budget,
+                "session_budget": self.session_budget,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_image_store():
+    """Return the process-wide session image store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionImageStore()
+        return _store
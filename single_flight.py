@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+
+
+def flight_key(*parts):
+    """Hash the parts that identify an upstream request (model, prompt, params, ...)"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _StreamFlight:
+    """Chunks of one in-flight stream, replayed to every session that attaches to it"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.consumers = 0  # Callers still reading; the upstream stream is closed when it drops to 0
+        self.abandoned = False
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests into one upstream call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future shared by everyone waiting on that call
+        self._streams = {}  # key -> _StreamFlight
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Run fn() unless an identical call is already in flight, in which case share its result"""
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stream(self, key, factory):
+        """Yield the chunks of factory()'s stream, sharing one upstream stream between identical callers"""
+        with self._lock:
+            self.calls += 1
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = _StreamFlight()
+                self._streams[key] = flight
+                # Pump upstream on its own thread so a leader session that reruns
+                # or disconnects doesn't stall everyone attached to the stream
+                threading.Thread(target=self._pump, args=(key, flight, factory), daemon=True).start()
+            else:
+                self.shared += 1
+            with flight.cond:
+                flight.consumers += 1
+
+        seen = 0
+        try:
+            while True:
+                with flight.cond:
+                    while seen == len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    new_chunks = flight.chunks[seen:]
+                    seen = len(flight.chunks)
+                    done, error = flight.done, flight.error
+                yield from new_chunks
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            # Everyone stopped reading (e.g. the user pressed Stop): let the pump close upstream,
+            # and make later identical requests start a fresh stream instead of this cut-off one
+            with self._lock:
+                with flight.cond:
+                    flight.consumers -= 1
+                    if flight.consumers == 0 and not flight.done:
+                        flight.abandoned = True
+                        if self._streams.get(key) is flight:
+                            del self._streams[key]
+
+    def _pump(self, key, flight, factory):
+        upstream = None
+        try:
+            upstream = factory()
+            for chunk in upstream:
+                with flight.cond:
+                    if flight.abandoned:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Closing the generator closes the HTTP response, so an abandoned reply stops costing quota
+            if upstream is not None:
+                upstream.close()
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared": self.shared,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide single-flight group"""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,187 @@
+import hashlib
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from chat import complete_chat, stream_chat
+
+# Configuration
+STORY_PLAN_CACHE_SIZE = int(os.getenv("STORY_PLAN_CACHE_SIZE", "256"))  # Story plans kept in memory
+
+CHARACTER_PROMPT = """Analyze this story and list ALL characters with BRIEF but SPECIFIC descriptions.
+
+Story: {story}
+
+For each character, write ONE LINE with:
+- Name
+- Type/species with color (e.g., "light brown bunny", "green dinosaur", "orange turtle")
+- One key feature (e.g., "floppy ears", "long neck", "small shell")
+
+Format: [Name] the [color] [type] with [key feature]
+Example: Benny the light brown cottontail bunny with long floppy ears
+
+List all characters, one per line."""
+
+SCENE_PROMPT = """Split this story into {pages} scenes. For EACH scene, write ONLY what the characters are DOING and WHERE they are.
+
+Story: {story}
+
+Format (one per line):
+Page 1: [brief action and setting]
+Page 2: [brief action and setting]
+
+Example:
+Page 1: playing in a sunny forest clearing
+Page 2: meeting a new friend by a pond
+Page 3: searching for food together in the meadow
+
+Provide exactly {pages} scenes."""
+
+FILLER_ACTION = "continuing their adventure in a beautiful scene"
+SCENE_STYLE = "children's book illustration, cute cartoon style, vibrant colors, consistent character design"
+
+# "Page 3: ...", "**Page 3** - ...", "page 3 – ..."
+_PAGE_LINE = re.compile(r"^\W*page\s*(\d+)\W*?[:\-–]\s*(.+?)\s*$", re.IGNORECASE)
+# Bullets and numbering models put in front of character lines
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def parse_scene_line(line):
+    """Return (page number, action) for a well-formed scene line, or None"""
+    match = _PAGE_LINE.match(line)
+    if not match or len(match.group(2)) <= 5:
+        return None
+    return int(match.group(1)), match.group(2).strip("*").strip()
+
+
+def parse_characters(text):
+    """Character description lines without list markers or preamble"""
+    lines = (_LIST_MARKER.sub("", line).strip().strip("*").strip() for line in text.splitlines())
+    return [line for line in lines if len(line.split()) >= 2 and not line.endswith(":")]
+
+
+def scene_prompt(characters, action):
+    """Full image prompt for a page: every character, the page's action and the book style"""
+    return f"{', '.join(characters)}, {action}, {SCENE_STYLE}"
+
+
+class StoryPlan:
+    """Characters and per-page actions for one story"""
+
+    def __init__(self, characters, actions, complete):
+        self.characters = characters
+        self.actions = actions
+        self.complete = complete  # False when scenes were missing and filler was used
+
+    def scenes(self):
+        return [scene_prompt(self.characters, action) for action in self.actions]
+
+
+def build_plan(characters_text, actions, num_pages):
+    """Validate the parsed completions into a StoryPlan, padding missing pages with filler"""
+    characters = parse_characters(characters_text)
+    complete = bool(characters) and len(actions) == num_pages
+    return StoryPlan(
+        characters or [characters_text.strip()],
+        [actions.get(page, FILLER_ACTION) for page in range(1, num_pages + 1)],
+        complete
+    )
+
+
+def story_cache_key(story, num_pages, model):
+    return hashlib.sha256(f"{model}\x00{num_pages}\x00{story.strip()}".encode("utf-8")).hexdigest()
+
+
+class StoryPlanStream:
+    """Yields (page index, scene prompt) as each "Page N:" line of the scene list streams in"""
+    # Iterate once; afterwards plan holds the validated plan, with any missing pages
+    # padded with filler (those pages are yielded last)
+
+    def __init__(self, planner, key, num_pages, characters=None, chunks=None, plan=None):
+        self._planner = planner
+        self._key = key
+        self._characters = characters  # Future with the character completion
+        self._chunks = chunks
+        self.num_pages = num_pages
+        self.plan = plan
+
+    def __iter__(self):
+        if self.plan is not None:
+            yield from enumerate(self.plan.scenes())
+            return
+
+        actions = {}
+        characters = None
+        buffer = ""
+        for chunk in itertools.chain(self._chunks, ["\n"]):
+            buffer += chunk
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                parsed = parse_scene_line(line)
+                if not parsed or not 1 <= parsed[0] <= self.num_pages or parsed[0] in actions:
+                    continue
+                page, action = parsed
+                actions[page] = action
+                if characters is None:
+                    characters = parse_characters(self._characters.result()) or [self._characters.result().strip()]
+                yield page - 1, scene_prompt(characters, action)
+
+        self.plan = build_plan(self._characters.result(), actions, self.num_pages)
+        for page in range(1, self.num_pages + 1):
+            if page not in actions:
+                yield page - 1, self.plan.scenes()[page - 1]
+        if self.plan.complete:
+            self._planner.remember(self._key, self.plan)
+
+
+class StoryPlanner:
+    """Plans stories with the character and scene requests in flight at the same time"""
+    # Only complete plans are cached, so a story that came back malformed is asked again
+
+    def __init__(self, max_entries=STORY_PLAN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="story-plan")
+
+    def remember(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def stream(self, client, story, num_pages, model, fallbacks=()):
+        """Start planning a story and return a StoryPlanStream over its pages (cached plans replay at once)"""
+        key = story_cache_key(story, num_pages, model)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return StoryPlanStream(self, key, num_pages, plan=plan)
+
+        characters = self._pool.submit(
+            complete_chat, client, [{"role": "user", "content": CHARACTER_PROMPT.format(story=story)}], model,
+            max_tokens=300, fallbacks=fallbacks
+        )
+        chunks = stream_chat(
+            client, [{"role": "user", "content": SCENE_PROMPT.format(story=story, pages=num_pages)}], model,
+            max_tokens=500, fallbacks=fallbacks
+        )
+        return StoryPlanStream(self, key, num_pages, characters, chunks)
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def get_story_planner():
+    """Return the process-wide story planner"""
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            _planner = StoryPlanner()
+        return _planner
@@ -0,0 +1,155 @@
+import struct
+import textwrap
+import zipfile
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+# PDF page layout in points (A4)
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 40
+TITLE_SIZE = 16
+CAPTION_SIZE = 11
+CAPTION_LEADING = 14
+CAPTION_MAX_LINES = 10
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def write_storybook_zip(out, pages):
+    """Write (png_bytes, caption) pages to out as a ZIP of page images plus a story.txt"""
+    # PNGs are stored as-is (already compressed); pages are consumed one at a time
+    captions = []
+    with zipfile.ZipFile(out, "w") as archive:
+        for number, (image, caption) in enumerate(pages, start=1):
+            captions.append(f"Page {number}: {caption}")
+            if image:
+                archive.writestr(f"page_{number:02d}.png", image, compress_type=zipfile.ZIP_STORED)
+        archive.writestr("story.txt", "\n\n".join(captions) + "\n", compress_type=zipfile.ZIP_DEFLATED)
+
+
+def _png_stream(data):
+    """Return (width, height, colors, zlib data) for PNGs a PDF can embed without decoding, else None"""
+    # 8-bit, non-interlaced grey or RGB PNGs carry the same zlib stream a PDF
+    # FlateDecode image with PNG predictors expects, so IDAT chunks are copied verbatim
+    if data[:8] != PNG_SIGNATURE:
+        return None
+    pos, idat, header = 8, [], None
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif chunk_type == b"IDAT":
+            idat.append(body)
+        elif chunk_type == b"IEND":
+            break
+    if header is None:
+        return None
+    width, height, depth, color_type, _, _, interlace = header
+    if depth != 8 or interlace or color_type not in (0, 2):
+        return None
+    return width, height, 1 if color_type == 0 else 3, b"".join(idat)
+
+
+def _image_object(data):
+    """PDF image XObject (dictionary, stream, width, height) for PNG bytes"""
+    embedded = _png_stream(data)
+    if embedded is not None:
+        width, height, colors, stream = embedded
+        space = "/DeviceGray" if colors == 1 else "/DeviceRGB"
+        params = f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {width} >>"
+        return f"/Filter /FlateDecode {params} /ColorSpace {space}", stream, width, height
+
+    # Anything else (alpha, palette, interlaced) is decoded once and re-encoded as JPEG
+    image = Image.open(BytesIO(data)).convert("RGB")
+    jpeg = BytesIO()
+    image.save(jpeg, format="JPEG", quality=90)
+    return "/Filter /DCTDecode /ColorSpace /DeviceRGB", jpeg.getvalue(), image.width, image.height
+
+
+def _pdf_text(text):
+    escaped = text.encode("cp1252", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    return b"(" + escaped + b")"
+
+
+class _PdfWriter:
+    """Writes numbered PDF objects straight to a file object, remembering offsets for the xref table"""
+
+    def __init__(self, out):
+        self.out = out
+        self.pos = 0
+        self.offsets = {}
+
+    def write(self, data):
+        self.out.write(data)
+        self.pos += len(data)
+
+    def obj(self, number, body, stream=None):
+        self.offsets[number] = self.pos
+        self.write(f"{number} 0 obj\n".encode("ascii"))
+        if stream is None:
+            self.write(body.encode("ascii") + b"\nendobj\n")
+        else:
+            self.write(f"<< {body} /Length {len(stream)} >>\nstream\n".encode("ascii"))
+            self.write(stream)
+            self.write(b"\nendstream\nendobj\n")
+
+
+def write_storybook_pdf(out, pages):
+    """Write (png_bytes, caption) pages to out as a paginated PDF, one story page per PDF page"""
+    # Pages are consumed and written one at a time, so only one image is ever held
+    pdf = _PdfWriter(out)
+    pdf.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    pdf.obj(3, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    pdf.obj(4, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+    kids = []
+    next_number = 5
+    usable_width = PAGE_WIDTH - 2 * MARGIN
+    for page_number, (image, caption) in enumerate(pages, start=1):
+        image_number, content_number, page_number_obj = next_number, next_number + 1, next_number + 2
+        next_number += 3
+
+        top = PAGE_HEIGHT - MARGIN - TITLE_SIZE
+        content = [b"BT /F2 %d Tf %d %d Td " % (TITLE_SIZE, MARGIN, top) + _pdf_text(f"Page {page_number}") + b" Tj ET"]
+        cursor = top - 12
+
+        lines = textwrap.wrap(caption, width=int(usable_width / (CAPTION_SIZE * 0.5)))[:CAPTION_MAX_LINES]
+        caption_height = len(lines) * CAPTION_LEADING + 12
+        resources = "/Font << /F1 3 0 R /F2 4 0 R >>"
+        if image:
+            body, stream, width, height = _image_object(image)
+            pdf.obj(image_number, f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                  f"/BitsPerComponent 8 {body}", stream)
+            scale = min(usable_width / width, (cursor - MARGIN - caption_height) / height)
+            draw_width, draw_height = width * scale, height * scale
+            cursor -= draw_height
+            content.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /Im1 Do Q"
+                           % (draw_width, draw_height, MARGIN + (usable_width - draw_width) / 2, cursor))
+            resources += f" /XObject << /Im1 {image_number} 0 R >>"
+        else:
+            pdf.obj(image_number, "null")
+            lines.insert(0, "(This page's image could not be generated.)")
+
+        if lines:
+            text = [b"BT /F1 %d Tf %d TL %d %.2f Td" % (CAPTION_SIZE, CAPTION_LEADING, MARGIN, cursor - CAPTION_LEADING - 6)]
+            text.extend(_pdf_text(line) + b" Tj T*" for line in lines)
+            content.append(b" ".join(text) + b" ET")
+
+        stream = zlib.compress(b"\n".join(content))
+        pdf.obj(content_number, "/Filter /FlateDecode", stream)
+        pdf.obj(page_number_obj, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                                 f"/Resources << {resources} >> /Contents {content_number} 0 R >>")
+        kids.append(f"{page_number_obj} 0 R")
+
+    pdf.obj(2, f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>")
+    pdf.obj(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+    xref = pdf.pos
+    lines = [f"xref\n0 {next_number}\n", "0000000000 65535 f \n"]
+    lines.extend(f"{pdf.offsets[n]:010d} 00000 n \n" for n in range(1, next_number))
+    pdf.write("".join(lines).encode("ascii"))
+    pdf.write(f"trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
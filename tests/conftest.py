@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# The app modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Offline backend and throwaway storage, set before any app module reads its settings
+_scratch = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("INFERENCE_BACKEND", "fake")
+os.environ.setdefault("HF_WARMUP", "0")
+os.environ.setdefault("IMAGE_CACHE_DIR", os.path.join(_scratch, "image_cache"))
+os.environ.setdefault("SESSION_IMAGE_DIR", os.path.join(_scratch, "session_images"))
+os.environ.setdefault("GALLERY_DIR", os.path.join(_scratch, "gallery"))
@@ -0,0 +1,33 @@
+from chat import ConversationContext
+
+
+def turn(role, content):
+    return {"role": role, "content": content, "type": "text"}
+
+
+PENDING = {"role": "assistant", "content": "", "type": "pending", "job_id": "x", "kind": "chat"}
+
+
+def test_pending_replies_are_not_sent_upstream():
+    history = [turn("user", "hi"), PENDING]
+    messages = ConversationContext().build(history, "are you there?")
+    assert messages == [{"role": "user", "content": "hi"}, {"role": "user", "content": "are you there?"}]
+
+
+def test_pending_replies_are_not_folded_into_the_summary():
+    history = [turn("user", "first " * 40), PENDING, turn("user", "second " * 40), turn("assistant", "ok")]
+    context = ConversationContext(token_budget=140, summary_budget=60)
+    messages = context.build(history, "third")
+    summary = messages[0]["content"]
+    assert messages[0]["role"] == "system"
+    assert "Assistant: " not in summary
+    assert all(m["content"] for m in messages)
+
+
+def test_old_turns_fold_into_a_summary_within_budget():
+    history = [turn("user" if i % 2 == 0 else "assistant", f"message {i} " * 20) for i in range(20)]
+    context = ConversationContext(token_budget=300, summary_budget=80)
+    messages = context.build(history, "latest")
+    assert messages[0]["role"] == "system"
+    assert messages[-1] == {"role": "user", "content": "latest"}
+    assert sum(len(m["content"]) // 4 + 1 for m in messages) <= 300
@@ -0,0 +1,66 @@
+import time
+
+from hedging import Hedger, percentile
+
+
+def slow(seconds, value):
+    def fn():
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def warmed_up(latency=0.02, samples=4):
+    hedger = Hedger(pct=95, min_samples=samples)
+    for _ in range(samples):
+        hedger.call("a", slow(latency, "a"), "b", slow(latency, "b"))
+    return hedger
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 95) == 95
+    assert percentile(values, 50) == 50
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_no_hedging_until_enough_samples():
+    hedger = Hedger(min_samples=3)
+    assert hedger.hedge_delay("a") is None
+    assert hedger.call("a", slow(0.05, "a"), "b", slow(0, "b")) == "a"
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_slow_primary_is_hedged_and_the_hedge_wins():
+    hedger = warmed_up()
+    assert hedger.call("a", slow(1.0, "a"), "b", slow(0.01, "b")) == "b"
+    stats = hedger.stats()
+    assert stats["requests"] == 5
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
+    assert stats["hedge_win_rate"] == 1.0
+    assert stats["hedge_rate"] == 0.2
+
+
+def test_primary_that_finishes_first_still_wins_after_hedging():
+    hedger = warmed_up()
+    assert hedger.call("a", slow(0.1, "a"), "b", slow(1.0, "b")) == "a"
+    stats = hedger.stats()
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 0
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = warmed_up(latency=0.2)
+    assert hedger.call("a", slow(0.01, "a"), "b", slow(0, "b")) == "a"
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_failed_primary_falls_back_to_the_hedge():
+    hedger = warmed_up()
+
+    def broken():
+        time.sleep(0.1)
+        raise RuntimeError("503")
+
+    assert hedger.call("a", broken, "b", slow(0.2, "b")) == "b"
@@ -0,0 +1,20 @@
+import huggingface_hub
+
+import inference_client
+
+
+def test_tuned_limits_are_on_the_live_client():
+    inference_client._configure_http_pool()
+    session = huggingface_hub.get_session()
+    pool = session._transport._pool
+    assert pool._max_connections == inference_client.HF_POOL_SIZE
+    assert pool._max_keepalive_connections == inference_client.HF_POOL_SIZE
+    assert pool._keepalive_expiry == inference_client.HF_KEEPALIVE_EXPIRY
+    assert session.timeout.connect == inference_client.HF_CONNECT_TIMEOUT
+    assert session.timeout.read == inference_client.HF_TIMEOUT
+
+
+def test_library_request_hooks_are_kept():
+    default_hooks = huggingface_hub.get_session().event_hooks["request"]
+    inference_client._configure_http_pool()
+    assert huggingface_hub.get_session().event_hooks["request"] == default_hooks
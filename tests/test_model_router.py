@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+import model_router
+from backends import FakeHTTPError
+from model_router import ModelRouter
+
+
+def failing(errors):
+    """fn for router.call(): models in errors raise that status, the rest answer with their name"""
+    calls = []
+
+    def fn(model):
+        calls.append(model)
+        if model in errors:
+            raise FakeHTTPError(errors[model], "test")
+        return model
+    return fn, calls
+
+
+def test_gone_fallback_trips_and_the_next_one_answers():
+    router = ModelRouter()
+    fn, calls = failing({"a": 404, "b": 410})
+    assert router.call(["a", "b", "c"], fn) == "c"
+    assert calls == ["a", "b", "c"]
+    snapshot = router.snapshot()
+    assert snapshot["a"]["circuit"] == "open"
+    assert snapshot["b"]["circuit"] == "open"
+
+    # Later requests skip the removed models instead of hitting them again
+    calls.clear()
+    assert router.call(["a", "b", "c"], fn) == "c"
+    assert calls == ["c"]
+
+
+@pytest.mark.parametrize("status", [400, 413, 422])
+def test_rejected_request_is_not_a_model_failure(status):
+    router = ModelRouter()
+    fn, calls = failing({"a": status})
+    with pytest.raises(FakeHTTPError):
+        router.call(["a", "b"], fn)
+    assert calls == ["a"]
+    assert router.snapshot()["a"]["calls"] == 0
+
+
+def test_circuit_opens_after_repeated_errors(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTER_MIN_CALLS", 3)
+    router = ModelRouter()
+    fn, calls = failing({"a": 503})
+    for _ in range(3):
+        assert router.call(["a", "b"], fn) == "b"
+    assert router.snapshot()["a"]["circuit"] == "open"
+
+    calls.clear()
+    assert router.call(["a", "b"], fn) == "b"
+    assert calls == ["b"]
+
+
+def test_half_open_trial_closes_the_circuit_on_success(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTER_COOLDOWN", 0.05)
+    router = ModelRouter()
+    errors = {"a": 503}
+    fn, calls = failing(errors)
+    for _ in range(3):
+        router.call(["a", "b"], fn)
+    assert router.snapshot()["a"]["circuit"] == "open"
+
+    time.sleep(0.1)
+    del errors["a"]  # Recovered: the trial request after the cooldown goes to "a" again
+    calls.clear()
+    assert router.call(["a", "b"], fn) == "a"
+    assert calls == ["a"]
+    assert router.snapshot()["a"]["circuit"] == "closed"
+
+
+def test_failed_trial_reopens_the_circuit(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTER_COOLDOWN", 0.05)
+    router = ModelRouter()
+    fn, calls = failing({"a": 503})
+    for _ in range(3):
+        router.call(["a", "b"], fn)
+
+    time.sleep(0.1)
+    calls.clear()
+    assert router.call(["a", "b"], fn) == "b"
+    assert calls == ["a", "b"]
+    assert router.snapshot()["a"]["retry_in"] > 0
+
+
+def test_quota_errors_open_the_circuit_at_once():
+    router = ModelRouter()
+    fn, _ = failing({"a": 429})
+    assert router.call(["a", "b"], fn) == "b"
+    assert router.snapshot()["a"]["circuit"] == "open"
+
+
+def test_health_is_recorded_against_the_model_that_served():
+    router = ModelRouter()
+    assert router.call(["a", "b"], lambda model: ("image", "b"), served_by=lambda result: result[1])
+    snapshot = router.snapshot()
+    assert snapshot["b"]["calls"] == 1
+    assert snapshot["a"]["calls"] == 0
@@ -0,0 +1,47 @@
+import pytest
+
+from prompt_index import PromptIndex, canonicalize_prompt
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = PromptIndex(path=str(tmp_path / "prompts.jsonl"))
+    index.add("A sunset over mountains, digital art", "model-a", "sunset")
+    index.add("a fox running through a forest, warm lighting, watercolor", "model-a", "fox")
+    return index
+
+
+def test_canonical_form_ignores_order_articles_plurals_and_quality_terms():
+    assert (canonicalize_prompt("digital art, sunset over the mountain, high quality")
+            == canonicalize_prompt("A sunset over mountains, digital art"))
+
+
+@pytest.mark.parametrize("prompt", [
+    "a sunset over the mountain, digital art",
+    "sunset over mountains digital art",
+    "Digital art; the sunset over mountains, sharp focus",
+])
+def test_near_miss_prompts_match(index, prompt):
+    matches = index.find(prompt)
+    assert [m["key"] for m in matches] == ["sunset"]
+
+
+@pytest.mark.parametrize("prompt", [
+    "a fox running through a forest, moonlight, watercolor",  # Lighting swapped
+    "a fox running through a forest, warm lighting, oil painting",  # Style swapped
+    "a fox running through a forest, warm lighting, watercolor, 4k",  # Extra tag
+])
+def test_prompts_with_a_different_tag_do_not_match(index, prompt):
+    assert index.find(prompt) == []
+
+
+def test_params_must_be_equal(index):
+    assert index.find("A sunset over mountains, digital art", width=512) == []
+
+
+def test_forgotten_entries_stay_gone_after_reload(index, tmp_path):
+    index.forget("sunset")
+    assert index.find("A sunset over mountains, digital art") == []
+    reloaded = PromptIndex(path=str(tmp_path / "prompts.jsonl"))
+    assert reloaded.find("A sunset over mountains, digital art") == []
+    assert [m["key"] for m in reloaded.find("watercolor, a fox running through the forest, warm lighting")] == ["fox"]
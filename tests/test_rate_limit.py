@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimitExceeded, TokenBucket
+
+
+def test_burst_goes_out_at_once_then_callers_queue_at_the_rate():
+    bucket = TokenBucket(rate_per_min=600, burst=2)  # One token every 0.1s
+    start = time.monotonic()
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    waited = bucket.acquire()
+    assert 0.05 < waited <= 0.15
+    assert time.monotonic() - start >= waited
+
+
+def test_tokens_refill_up_to_the_burst_size():
+    bucket = TokenBucket(rate_per_min=6000, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    time.sleep(0.1)  # Enough for 10 tokens, but the bucket only holds 3
+    assert bucket.stats()["tokens"] == pytest.approx(3)
+
+
+def test_callers_that_would_wait_too_long_are_turned_away():
+    bucket = TokenBucket(rate_per_min=6, burst=1)
+    bucket.acquire()
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        bucket.acquire(max_wait=1)
+    assert excinfo.value.wait == pytest.approx(10, abs=0.5)
+    assert bucket.estimate_wait() == pytest.approx(10, abs=0.5)
+
+
+def test_quota_errors_halve_the_rate_and_back_off_exponentially(monkeypatch):
+    monkeypatch.setattr(rate_limit, "BACKOFF_MAX", 4)
+    bucket = TokenBucket(rate_per_min=60, burst=5)
+    bucket.penalize()
+    stats = bucket.stats()
+    assert stats["rate_per_min"] == pytest.approx(30)
+    assert stats["paused_for"] == pytest.approx(1, abs=0.05)
+
+    for _ in range(5):
+        bucket.penalize()
+    stats = bucket.stats()
+    assert stats["rate_per_min"] == pytest.approx(60 / 16)  # Never below a sixteenth
+    assert stats["paused_for"] == pytest.approx(4, abs=0.05)  # Capped at BACKOFF_MAX
+
+
+def test_successes_creep_back_to_the_configured_rate():
+    bucket = TokenBucket(rate_per_min=60, burst=5)
+    bucket.penalize()
+    bucket.reward()
+    assert bucket.stats()["rate_per_min"] == pytest.approx(36)
+    for _ in range(10):
+        bucket.reward()
+    assert bucket.stats()["rate_per_min"] == pytest.approx(60)
+
+
+def test_queued_callers_honour_a_pause():
+    bucket = TokenBucket(rate_per_min=6000, burst=5)
+    bucket.penalize()
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.95
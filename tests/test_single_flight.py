@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+
+from backends import FakeInferenceBackend
+from chat import stream_chat
+from single_flight import SingleFlight, get_single_flight
+
+
+class CountingBackend(FakeInferenceBackend):
+    """Fake backend that counts upstream chat calls"""
+
+    def __init__(self, **kwargs):
+        super().__init__(jitter=0, **kwargs)
+        self.chat_calls = 0
+
+    def chat_completion(self, messages, **kwargs):
+        with self._lock:
+            self.chat_calls += 1
+        return super().chat_completion(messages, **kwargs)
+
+
+def run_together(n, fn):
+    results = [None] * n
+    errors = [None] * n
+    start = threading.Barrier(n)
+
+    def worker(i):
+        start.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results, errors
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        return "image"
+
+    def call():
+        return flight.do("key", upstream)
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_together(5, call)
+    assert results == ["image"] * 5
+    assert errors == [None] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 5, "shared": 4, "in_flight": 0}
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def upstream():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threading.Timer(0.2, release.set).start()
+    _, errors = run_together(3, lambda: flight.do("key", upstream))
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.do("key", lambda: "retried") == "retried"
+
+
+def test_late_stream_reader_gets_the_chunks_it_missed():
+    flight = SingleFlight()
+    step = threading.Semaphore(0)
+
+    def upstream():
+        for chunk in ("a", "b", "c", "d"):
+            step.acquire()
+            yield chunk
+
+    first = flight.stream("key", upstream)
+    step.release()
+    step.release()
+    assert [next(first), next(first)] == ["a", "b"]
+    second = flight.stream("key", lambda: pytest.fail("second upstream opened"))
+    assert [next(second), next(second)] == ["a", "b"]
+    step.release()
+    step.release()
+    assert list(first) == ["c", "d"]
+    assert list(second) == ["c", "d"]
+    assert flight.stats()["shared"] == 1
+
+
+def test_abandoned_stream_closes_upstream():
+    flight = SingleFlight()
+    closed = threading.Event()
+
+    def upstream():
+        try:
+            while True:
+                yield "chunk"
+        finally:
+            closed.set()
+
+    reader = flight.stream("key", upstream)
+    next(reader)
+    reader.close()
+    assert closed.wait(5)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_identical_fake_backend_streams_coalesce():
+    backend = CountingBackend(chat_latency=0.2, token_latency=0.001)
+    messages = [{"role": "user", "content": "tell me a joke"}]
+    before = get_single_flight().stats()["shared"]
+
+    results, errors = run_together(3, lambda: "".join(stream_chat(backend, messages, "model")))
+    assert errors == [None] * 3
+    assert len(set(results)) == 1 and results[0]
+    assert backend.chat_calls == 1
+    assert get_single_flight().stats()["shared"] - before == 2
@@ -0,0 +1,84 @@
+import re
+import zipfile
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+from storybook import write_storybook_pdf, write_storybook_zip
+
+
+def png(mode="RGB", size=(32, 24), color=(200, 30, 30)):
+    if mode == "RGBA":
+        color = (*color, 128)
+    elif mode == "L":
+        color = color[0]
+    out = BytesIO()
+    Image.new(mode, size, color).save(out, format="PNG")
+    return out.getvalue()
+
+
+PAGES = [
+    (png(), "A bunny packs a bag."),
+    (png("RGBA"), "The bunny (with a hat) boards a train \\ waves."),
+    (None, "This page failed."),
+    (png("L"), "Home again."),
+]
+
+
+def build_pdf(pages):
+    out = BytesIO()
+    write_storybook_pdf(out, iter(pages))
+    return out.getvalue()
+
+
+def test_xref_offsets_point_at_their_objects():
+    pdf = build_pdf(PAGES)
+    startxref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", pdf).group(1))
+    assert pdf[startxref:].startswith(b"xref\n")
+
+    header = re.match(rb"xref\n0 (\d+)\n", pdf[startxref:])
+    count = int(header.group(1))
+    entries = pdf[startxref + header.end():].split(b"\n")[:count]
+    assert entries[0] == b"0000000000 65535 f "
+    for number, entry in enumerate(entries[1:], start=1):
+        offset = int(entry[:10])
+        assert entry.endswith(b" 00000 n "), entry
+        assert pdf[offset:].startswith(b"%d 0 obj\n" % number)
+    assert re.search(rb"trailer\n<< /Size %d /Root 1 0 R >>" % count, pdf)
+
+
+def test_one_pdf_page_per_story_page():
+    pdf = build_pdf(PAGES)
+    assert b"/Count 4" in pdf
+    assert len(re.findall(rb"/Type /Page ", pdf)) == 4
+    # RGB and grey PNGs are embedded as-is, anything else as JPEG
+    assert pdf.count(b"/Predictor 15") == 2
+    assert pdf.count(b"/DCTDecode") == 1
+
+
+def test_captions_are_escaped_in_the_content_streams():
+    pdf = build_pdf(PAGES)
+    streams = [zlib.decompress(m.group(1)) for m in re.finditer(
+        rb"<< /Filter /FlateDecode /Length \d+ >>\nstream\n(.*?)\nendstream", pdf, re.S)]
+    text = b"\n".join(streams)
+    assert rb"\(with a hat\)" in text
+    assert b"\\\\ waves" in text
+    assert b"could not be generated" in text
+
+
+def test_embedded_png_data_is_copied_verbatim():
+    image = png()
+    pdf = build_pdf([(image, "one")])
+    idat = re.search(rb"IDAT(.*?)....IEND", image, re.S).group(1)[:-4]
+    assert idat in pdf
+
+
+def test_zip_has_the_pages_and_the_story_text():
+    out = BytesIO()
+    write_storybook_zip(out, iter(PAGES))
+    with zipfile.ZipFile(BytesIO(out.getvalue())) as archive:
+        assert archive.namelist() == ["page_01.png", "page_02.png", "page_04.png", "story.txt"]
+        assert archive.read("page_01.png") == PAGES[0][0]
+        story = archive.read("story.txt").decode("utf-8")
+    assert "Page 3: This page failed." in story